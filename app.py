@@ -1,11 +1,33 @@
 # To run this do (in the console)
 # streamlit run app.py
 
-import streamlit as st
-import random
-import colorsys
+import asyncio
+import json
 import math
-import time
+import os
+import tempfile
+
+import streamlit as st
+
+from hosting import BattleHost, HostBusy
+from lobby import SPLIT_METHODS, initialize_commanders, partition_teams, roster_hash
+from profiler import TickProfiler
+from render import (
+    FragmentCache,
+    PlaceholderWriter,
+    RenderTemplates,
+    render_arena,
+    render_battle_map,
+    render_commander_box,
+    render_density_map,
+    render_profile_summary,
+    render_team_summary,
+    sample_evenly,
+    team_colors,
+)
+from replay import DEFAULT_KEYFRAME_EVERY, Replay, ReplayWriter
+from rng import SimContext
+from simulation import BattleSimulator, map_size, run_realtime, MAP_HEIGHT, MAP_WIDTH
 
 # ---------------------------------------------------------
 # 1. SETUP & SCI-FI STYLING
@@ -13,429 +35,152 @@ import time
 
 st.set_page_config(page_title="BAR Commander Sim", layout="wide", page_icon="⚙️")
 
-st.markdown("""
-<style>
-    /* Dark Sci-Fi Background */
-    .stApp {
-        background-color: #050505;
-        color: #e0e0e0;
-    }
-
-    /* Animations */
-    @keyframes shake {
-        0% { transform: translate(1px, 1px) rotate(0deg); }
-        10% { transform: translate(-1px, -2px) rotate(-1deg); }
-        20% { transform: translate(-3px, 0px) rotate(1deg); }
-        30% { transform: translate(3px, 2px) rotate(0deg); }
-        40% { transform: translate(1px, -1px) rotate(1deg); }
-        50% { transform: translate(-1px, 2px) rotate(-1deg); }
-        60% { transform: translate(-3px, 1px) rotate(0deg); }
-        100% { transform: translate(0px, 0px) rotate(0deg); }
-    }
-
-    @keyframes blast {
-        0% { transform: scale(1); box-shadow: 0 0 0 red; opacity: 1;}
-        50% { transform: scale(1.5); box-shadow: 0 0 50px red; opacity: 0.5;}
-        100% { transform: scale(0); opacity: 0;}
-    }
-
-    .shake-box { animation: shake 0.4s; border: 2px solid #ff4444 !important; }
-    .blast-box { animation: blast 0.6s forwards; background-color: white !important; }
-
-    .attacker-box {
-        border: 2px solid #00ffff !important;
-        transform: scale(1.1);
-        z-index: 10;
-        box-shadow: 0 0 15px #00ffff;
-    }
-
-    /* Resource Bars */
-    .bar-container {
-        width: 100%; height: 4px; background-color: #333;
-        margin-top: 2px; position: relative;
-    }
-    .hp-fill { height: 100%; background-color: #00ff00; transition: width 0.2s; }
-    .energy-fill { height: 100%; background-color: #ffff00; transition: width 0.2s; }
-
-    /* Terminal Log */
-    .battle-log {
-        background-color: #0a0a0a;
-        border: 1px solid #333;
-        border-left: 4px solid #00ffff;
-        font-family: 'Consolas', 'Courier New', monospace;
-        padding: 15px;
-        height: 200px;
-        overflow-y: auto;
-        font-size: 11px;
-        color: #cccccc;
-        display: flex; flex-direction: column-reverse;
-    }
-    .log-dgun { color: #ffff00; font-weight: bold; text-shadow: 0 0 5px #ffff00; }
-    .log-kill { color: #ff4444; font-weight: bold; }
-
-    /* Faction Badges */
-    .faction-label {
-        font-size: 10px; text-transform: uppercase; letter-spacing: 1px;
-        margin-bottom: 5px; color: #888;
-    }
-
-    /* RTS Map */
-    .rts-map {
-        position: relative;
-        width: 100%;
-        height: 360px;
-        background:
-            radial-gradient(circle at 20% 20%, rgba(0, 255, 255, 0.06), transparent 40%),
-            radial-gradient(circle at 80% 80%, rgba(255, 68, 68, 0.06), transparent 40%),
-            linear-gradient(rgba(255,255,255,0.04) 1px, transparent 1px),
-            linear-gradient(90deg, rgba(255,255,255,0.04) 1px, transparent 1px),
-            #050505;
-        background-size: auto, auto, 30px 30px, 30px 30px, auto;
-        border: 1px solid #222;
-        box-shadow: inset 0 0 20px rgba(0,0,0,0.8);
-        overflow: hidden;
-    }
-
-    .unit-dot {
-        position: absolute;
-        width: 10px;
-        height: 10px;
-        transform: translate(-50%, -50%);
-        border: 1px solid rgba(255,255,255,0.4);
-        box-shadow: 0 0 6px rgba(0,0,0,0.6);
-    }
-
-    .unit-attacker { box-shadow: 0 0 8px #00ffff, 0 0 12px #00ffff; }
-    .unit-hit { animation: hitFlash 0.25s; }
-    .unit-spawn { animation: spawnPop 0.4s; }
-    .unit-dead { animation: unitDie 0.6s forwards; }
-
-    @keyframes hitFlash {
-        0% { transform: translate(-50%, -50%) scale(1.2); box-shadow: 0 0 10px #ff4444; }
-        100% { transform: translate(-50%, -50%) scale(1.0); box-shadow: 0 0 6px rgba(0,0,0,0.6); }
-    }
-
-    @keyframes spawnPop {
-        0% { transform: translate(-50%, -50%) scale(0.2); opacity: 0.0; }
-        80% { transform: translate(-50%, -50%) scale(1.2); opacity: 1.0; }
-        100% { transform: translate(-50%, -50%) scale(1.0); opacity: 1.0; }
-    }
-
-    @keyframes unitDie {
-        0% { transform: translate(-50%, -50%) scale(1.0); opacity: 1.0; }
-        100% { transform: translate(-50%, -50%) scale(0.2); opacity: 0.0; }
-    }
-</style>
-""", unsafe_allow_html=True)
+STYLESHEET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "app.css")
 
-# ---------------------------------------------------------
-# 2. CONSTANTS & DATA
-# ---------------------------------------------------------
 
-COMMON_COLORS = [
-    "#FF0000", "#0000FF", "#00FF00", "#FFFF00", "#800080", "#FFA500", "#00FFFF", "#FF00FF",
-    "#FFFFFF", "#808080", "#A52A2A", "#FFC0CB", "#008080", "#E6E6FA", "#40E0D0",
-    "#800000", "#000080", "#808000", "#C0C0C0", "#FFD700", "#4B0082", "#FA8072", "#98FB98",
-    "#DC143C", "#00BFFF", "#B22222", "#FF7F50", "#2E8B57", "#DDA0DD", "#F0E68C", "#708090"
-]
-
-# UPDATED: Added Legion
-FACTIONS = ["Armada", "Cortex", "Legion"]
-
-MAP_WIDTH = 640
-MAP_HEIGHT = 360
-FIRE_RANGE = 90
-MIN_SEPARATION = 18
-SEPARATION_FORCE = 2.4
-HARD_MIN_SEPARATION = 18
-SPAWN_FLASH_TICKS = 2
-DEATH_FLASH_TICKS = 2
+@st.cache_resource
+def inline_stylesheet():
+    with open(STYLESHEET) as handle:
+        return f"<style>{handle.read()}</style>"
 
-# ---------------------------------------------------------
-# 3. HELPER FUNCTIONS
-# ---------------------------------------------------------
 
-def hex_to_rgb(hex_code):
-    hex_code = hex_code.lstrip('#')
-    return tuple(int(hex_code[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+# With static serving on (.streamlit/config.toml) each rerun only sends a <link> the browser
+# caches; otherwise the stylesheet is read once per server and inlined.
+if st.get_option("server.enableStaticServing"):
+    st.markdown('<link rel="stylesheet" href="app/static/app.css">', unsafe_allow_html=True)
+else:
+    st.markdown(inline_stylesheet(), unsafe_allow_html=True)
 
+# ---------------------------------------------------------
+# 2. MAIN APP LOGIC
+# ---------------------------------------------------------
 
-def get_hsv(hex_code):
-    rgb = hex_to_rgb(hex_code)
-    return colorsys.rgb_to_hsv(rgb[0], rgb[1], rgb[2])
+st.title("⚙️ BAR Commander Simulator")
+st.markdown("Group Commanders by team color and simulate **Beyond All Reason** battles.")
 
+# The battle map redraws at most this often; faster tick rates skip frames instead of slowing down.
+MAX_RENDER_FPS = 20
+# The live profiling panel summarizes this many recent ticks.
+PROFILE_WINDOW = 100
+# Exported GIFs show every other tick to keep files small.
+GIF_TICKS_PER_FRAME = 2
+# Lobby layouts kept per server; each is one (roster, team count) pair.
+LOBBY_CACHE_ENTRIES = 32
+
+# Large battle mode: roster limits, and how many commander boxes any one view shows.
+LARGE_MAX_COMMANDERS = 20000
+LARGE_MAX_TEAMS = 100
+LARGE_POOL_SAMPLE = 120
+LARGE_ROSTER_PAGE = 200
+LARGE_ARENA_SAMPLE = 240
+LARGE_LOBBY_CACHE_ENTRIES = 4
+# Keyframes hold every unit, so large battles write them less often.
+LARGE_KEYFRAME_EVERY = 100
+# Battles running at once across all sessions; more are turned away.
+MAX_HOSTED_BATTLES = 8
+# How long a battle outlives a viewer's interrupted run, so RESOLVE INSTANTLY can still fast-forward it.
+RERUN_GRACE_SECONDS = 3.0
+# How long a seeded battle keeps running after its last viewer leaves, so a rerun can pick it up again.
+SHARED_BATTLE_GRACE_SECONDS = 10.0
 
-def color_distance(hex1, hex2):
-    r1, g1, b1 = hex_to_rgb(hex1)
-    r2, g2, b2 = hex_to_rgb(hex2)
-    return math.sqrt((r1 - r2) ** 2 + (g1 - g2) ** 2 + (b1 - b2) ** 2)
+# --- CONFIG ---
+st.sidebar.header("Lobby Settings")
+large_battle = st.sidebar.checkbox(
+    "Large battle mode", value=False,
+    help="Up to 20,000 commanders and 100 teams, drawn as team heatmaps with sampled commander boxes.",
+)
+if large_battle:
+    total_players = st.sidebar.slider("Commander Count", 100, LARGE_MAX_COMMANDERS, 10000, step=100)
+    num_teams = st.sidebar.slider("Team Count", 2, LARGE_MAX_TEAMS, 10)
+else:
+    total_players = st.sidebar.slider("Commander Count", 2, 100, 32)
+    num_teams = st.sidebar.slider("Team Count", 2, 10, 2)
+battle_seed = st.sidebar.number_input(
+    "Battle Seed", 0, 2**31 - 1, 0,
+    help="0 rolls a fresh lobby and battle. Any other seed always gives the same roster and battle, "
+    "and everyone watching the same seeded battle shares one simulation.",
+)
+split_method = st.sidebar.selectbox(
+    "Team Split", SPLIT_METHODS,
+    format_func={"cohesive": "Color cohesion", "hue": "Hue sort"}.get,
+    help="Color cohesion groups the closest colors together; hue sort is the original split.",
+)
+sim_speed = st.sidebar.slider("Tick Rate (s)", 0.05, 1.0, 0.1)
+# Large battles default to it: one shot a tick would take tens of thousands of ticks.
+simultaneous_fire = st.sidebar.checkbox(
+    "Simultaneous fire", value=large_battle,
+    help="Every commander in range of an enemy fires each tick, so battles resolve in far fewer ticks.",
+)
+area_effects = st.sidebar.checkbox(
+    "Area damage", value=False,
+    help="Dying commanders' comblasts hit everything nearby, and D-GUN shots hit every unit along their line of fire.",
+)
+regenerate = st.sidebar.button("Re-Roll Commanders")
+st.sidebar.caption("First 32 colors are standard palette. 33+ are procedurally generated.")
 
+st.sidebar.header("Diagnostics")
+profile_loop = st.sidebar.checkbox("Profile battle loop", value=False)
+profile_placeholder = st.sidebar.empty()
 
-def generate_distinct_color(existing_hexes):
-    threshold = 0.25
-    max_attempts = 50
-    attempts = 0
-    while True:
-        candidate = "#{:06x}".format(random.randint(0, 0xFFFFFF))
-        is_distinct = True
-        for existing in existing_hexes:
-            if color_distance(candidate, existing) < threshold:
-                is_distinct = False
-                break
-        if is_distinct: return candidate
-        attempts += 1
-        if attempts > max_attempts:
-            threshold *= 0.90
-            attempts = 0
 
+@st.cache_resource
+def get_battle_host():
+    """The one BattleHost every session of this server runs battles on."""
+    return BattleHost(MAX_HOSTED_BATTLES)
 
-def chunk_list(data, num_chunks):
-    k, m = divmod(len(data), num_chunks)
-    return [data[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(num_chunks)]
 
+@st.cache_data(max_entries=LOBBY_CACHE_ENTRIES, show_spinner=False)
+def derive_lobby(roster_key, num_teams, split_method, _players):
+    """
+    Team split, render templates and Lobby-tab HTML for a roster. Cached on
+    the roster hash (_players itself is not hashed), so reruns that only
+    touch other widgets skip the sort, the split and every commander box.
+    """
+    teams = partition_teams(_players, num_teams, split_method)
+    templates = RenderTemplates(_players)
 
-def sort_players_perceptually(players):
-    def sort_key(player):
-        h, s, v = get_hsv(player['hex'])
-        is_grayscale = s < 0.15 or v < 0.15
-        if is_grayscale:
-            return (0, v, 0)
-        else:
-            return (1, h, v)
-
-    return sorted(players, key=sort_key)
-
-
-def clamp(value, low, high):
-    return max(low, min(high, value))
-
-
-def initialize_positions(teams, width, height, margin=18):
-    positions = {}
-    if not teams:
-        return positions
-
-    band_width = width / max(1, len(teams))
-    for t_idx, team in enumerate(teams):
-        x_min = t_idx * band_width + margin
-        x_max = (t_idx + 1) * band_width - margin
-        if x_max <= x_min:
-            x_min = margin
-            x_max = width - margin
-        for p in team:
-            positions[p['id']] = {
-                'x': random.uniform(x_min, x_max),
-                'y': random.uniform(margin, height - margin)
-            }
-    return positions
-
-
-def get_closest_enemy(pid, alive_ids, p_team_map, positions):
-    best_id = None
-    best_dist = None
-    for other_id in alive_ids:
-        if p_team_map[other_id] == p_team_map[pid]:
-            continue
-        dx = positions[other_id]['x'] - positions[pid]['x']
-        dy = positions[other_id]['y'] - positions[pid]['y']
-        dist = dx * dx + dy * dy
-        if best_dist is None or dist < best_dist:
-            best_dist = dist
-            best_id = other_id
-    return best_id
-
-
-def step_positions(
-    alive_ids,
-    p_team_map,
-    positions,
-    width,
-    height,
-    speed=3.2,
-    jitter=0.6,
-    margin=10,
-    min_sep=MIN_SEPARATION,
-    sep_force=SEPARATION_FORCE,
-    hard_min=HARD_MIN_SEPARATION
-):
-    for pid in alive_ids:
-        target_id = get_closest_enemy(pid, alive_ids, p_team_map, positions)
-        if not target_id:
-            continue
-        dx = positions[target_id]['x'] - positions[pid]['x']
-        dy = positions[target_id]['y'] - positions[pid]['y']
-        dist = math.hypot(dx, dy)
-        if dist == 0:
-            continue
-        nx = dx / dist
-        ny = dy / dist
-
-        repulse_x = 0.0
-        repulse_y = 0.0
-        if min_sep > 0:
-            for other_id in alive_ids:
-                if other_id == pid:
-                    continue
-                ox = positions[pid]['x'] - positions[other_id]['x']
-                oy = positions[pid]['y'] - positions[other_id]['y']
-                o_dist = math.hypot(ox, oy)
-                if 0 < o_dist < min_sep:
-                    scale = (min_sep - o_dist) / min_sep
-                    repulse_x += (ox / o_dist) * scale
-                    repulse_y += (oy / o_dist) * scale
-
-        positions[pid]['x'] = clamp(
-            positions[pid]['x'] + nx * speed + repulse_x * sep_force + random.uniform(-jitter, jitter),
-            margin,
-            width - margin
-        )
-        positions[pid]['y'] = clamp(
-            positions[pid]['y'] + ny * speed + repulse_y * sep_force + random.uniform(-jitter, jitter),
-            margin,
-            height - margin
+    def boxes(group):
+        return "".join(
+            render_commander_box(p, 100, 100, True, show_hud=False, template=templates.boxes[p['id']]) for p in group
         )
 
-        if hard_min > 0:
-            for other_id in alive_ids:
-                if other_id == pid:
-                    continue
-                ox = positions[pid]['x'] - positions[other_id]['x']
-                oy = positions[pid]['y'] - positions[other_id]['y']
-                o_dist = math.hypot(ox, oy)
-                if o_dist == 0:
-                    ox = random.uniform(-1.0, 1.0)
-                    oy = random.uniform(-1.0, 1.0)
-                    o_dist = math.hypot(ox, oy)
-                if o_dist < hard_min:
-                    push = (hard_min - o_dist) / o_dist
-                    positions[pid]['x'] = clamp(
-                        positions[pid]['x'] + ox * push,
-                        margin,
-                        width - margin
-                    )
-                    positions[pid]['y'] = clamp(
-                        positions[pid]['y'] + oy * push,
-                        margin,
-                        height - margin
-                    )
+    return teams, templates, boxes(_players), [boxes(tm) for tm in teams]
 
 
-# ---------------------------------------------------------
-# 4. RENDERER
-# ---------------------------------------------------------
-
-def render_commander_box(p, hp, energy, is_alive, event_type=None, show_hud=True):
+@st.cache_data(max_entries=LARGE_LOBBY_CACHE_ENTRIES, show_spinner=False)
+def derive_large_lobby(roster_key, num_teams, split_method, _players):
     """
-    Renders a 'Commander' unit box.
+    derive_lobby for large battle mode: only a sample of the pool is
+    rendered up front, and team rosters are rendered a page at a time.
     """
-    pid = p['id']
-    hex_c = p['hex']
-    faction = p['faction']
-
-    # Text Contrast
-    rgb = hex_to_rgb(hex_c)
-    brightness = (rgb[0] * 299 + rgb[1] * 587 + rgb[2] * 114) / 1000
-    text_color = "black" if brightness > 0.6 else "white"
-
-    # Animation Class
-    extra_class = ""
-    if is_alive:
-        if event_type == "hit":
-            extra_class = "shake-box"
-        elif event_type == "dgun":
-            extra_class = "attacker-box"  # DGUN uses attacker style
-        elif event_type == "attack":
-            extra_class = "attacker-box"
-    elif event_type == "die":
-        extra_class = "blast-box"  # Comblast effect
-
-    opacity = "1.0" if is_alive else "0.15"
-    content = f"<strong>{pid}</strong>"
-
-    # If dead, show skull
-    if not is_alive and event_type != "die":
-        content = "💀"
-
-    # HUD (Bars)
-    hud_html = ""
-    if is_alive and show_hud:
-        # Structure (HP)
-        hp_pct = max(0, hp)
-        # Energy (Yellow)
-        en_pct = max(0, energy)
-
-        hud_html = f"""
-        <div class="bar-container" title="Structure: {hp}%">
-            <div class="hp-fill" style="width:{hp_pct}%;"></div>
-        </div>
-        <div class="bar-container" title="Energy: {energy}%">
-            <div class="energy-fill" style="width:{en_pct}%;"></div>
-        </div>
-        """
-
-    # Shape style based on Faction
-    if faction == "Cortex":
-        radius = "0px"  # Square
-    elif faction == "Legion":
-        radius = "50%"  # Circle
-    else:
-        radius = "8px"  # Armada (Rounded)
-
-    style = (
-        f"background-color:{hex_c}; width:60px; height:60px; "
-        f"border-radius:{radius}; display:flex; flex-direction:column; "
-        f"align-items:center; justify-content:center; "
-        f"color:{text_color}; font-family:monospace; font-size:10px; "
-        f"box-shadow:0 0 5px rgba(0,0,0,0.5); opacity:{opacity}; "
-        f"position:relative; margin:5px; border: 1px solid rgba(255,255,255,0.2);"
+    teams = partition_teams(_players, num_teams, split_method)
+    pool_html = "".join(
+        render_commander_box(p, 100, 100, True, show_hud=False) for p in sample_evenly(_players, LARGE_POOL_SAMPLE)
     )
-
-    return f'<div class="{extra_class}" style="{style}" title="{faction} Commander {pid}">{content}{hud_html}</div>'
-
-
-# ---------------------------------------------------------
-# 5. MAIN APP LOGIC
-# ---------------------------------------------------------
-
-st.title("⚙️ BAR Commander Simulator")
-st.markdown("Group Commanders by team color and simulate **Beyond All Reason** battles.")
-
-# --- CONFIG ---
-st.sidebar.header("Lobby Settings")
-total_players = st.sidebar.slider("Commander Count", 2, 100, 32)
-num_teams = st.sidebar.slider("Team Count", 2, 10, 2)
-sim_speed = st.sidebar.slider("Tick Rate (s)", 0.05, 1.0, 0.1)
-regenerate = st.sidebar.button("Re-Roll Commanders")
-st.sidebar.caption("First 32 colors are standard palette. 33+ are procedurally generated.")
+    return teams, pool_html
 
 
 # --- STATE MANAGEMENT ---
-def initialize_commanders(n):
-    new_coms = []
-    limit = min(n, len(COMMON_COLORS))
-    for i in range(limit):
-        # Randomly assign faction from updated list (Armada, Cortex, Legion)
-        f = random.choice(FACTIONS)
-        new_coms.append({"id": str(i + 1), "hex": COMMON_COLORS[i], "faction": f})
-
-    if n > limit:
-        current_hexes = [p['hex'] for p in new_coms]
-        for i in range(limit, n):
-            new_hex = generate_distinct_color(current_hexes)
-            f = random.choice(FACTIONS)
-            new_coms.append({"id": str(i + 1), "hex": new_hex, "faction": f})
-            current_hexes.append(new_hex)
-    return new_coms
-
-
-if 'players' not in st.session_state or regenerate:
-    st.session_state.players = initialize_commanders(total_players)
-elif len(st.session_state.players) != total_players:
-    st.session_state.players = initialize_commanders(total_players)
+if (
+    'players' not in st.session_state or regenerate or len(st.session_state.players) != total_players
+    or st.session_state.get('roster_seed') != battle_seed
+):
+    if battle_seed:
+        st.session_state.players = initialize_commanders(total_players, rng=SimContext(battle_seed).lobby)
+    else:
+        st.session_state.players = initialize_commanders(total_players)
+    st.session_state.roster_key = roster_hash(st.session_state.players)
+    st.session_state.roster_seed = battle_seed
 
 players = st.session_state.players
-sorted_players = sort_players_perceptually(players)
-teams_list = chunk_list(sorted_players, num_teams)
+if large_battle:
+    teams_list, pool_html = derive_large_lobby(st.session_state.roster_key, num_teams, split_method, players)
+else:
+    teams_list, templates, pool_html, team_htmls = derive_lobby(
+        st.session_state.roster_key, num_teams, split_method, players
+    )
+    # The palette classes the templated boxes and dots are colored by.
+    st.markdown(templates.css, unsafe_allow_html=True)
 
 # --- TABS ---
 tab1, tab2 = st.tabs(["🏭 Lobby & Groups", "⚔️ Battle Simulation"])
@@ -444,179 +189,255 @@ with tab1:
     col_l, col_r = st.columns([1, 2])
     with col_l:
         st.subheader("Commander Pool")
-        html = "<div style='display:flex;flex-wrap:wrap;'>"
-        for p in players: html += render_commander_box(p, 100, 100, True, show_hud=False)
-        html += "</div>"
-        st.markdown(html, unsafe_allow_html=True)
+        if large_battle:
+            st.caption(f"Showing {min(LARGE_POOL_SAMPLE, len(players))} of {len(players):,} commanders.")
+        st.markdown(f"<div style='display:flex;flex-wrap:wrap;'>{pool_html}</div>", unsafe_allow_html=True)
     with col_r:
         st.subheader("Team Assignments")
-        for i, tm in enumerate(teams_list):
-            # REMOVED: Team Alignment Calculation. Just showing Team ID.
-            st.markdown(f"**Team {i + 1}**")
-            html = "<div style='display:flex;flex-wrap:wrap;'>"
-            for p in tm: html += render_commander_box(p, 100, 100, True, show_hud=False)
-            html += "</div>"
-            st.markdown(html, unsafe_allow_html=True)
+        if large_battle:
+            roster_team = st.selectbox(
+                "Team", range(len(teams_list)),
+                format_func=lambda t: f"Team {t + 1} ({len(teams_list[t]):,} commanders)",
+            )
+            team = teams_list[roster_team]
+            pages = max(1, math.ceil(len(team) / LARGE_ROSTER_PAGE))
+            page = st.number_input("Page", 1, pages, 1, help=f"{LARGE_ROSTER_PAGE} commanders per page")
+            page_players = team[(page - 1) * LARGE_ROSTER_PAGE:page * LARGE_ROSTER_PAGE]
+            page_html = "".join(render_commander_box(p, 100, 100, True, show_hud=False) for p in page_players)
+            st.markdown(f"<div style='display:flex;flex-wrap:wrap;'>{page_html}</div>", unsafe_allow_html=True)
+        else:
+            for i, team_html in enumerate(team_htmls):
+                # REMOVED: Team Alignment Calculation. Just showing Team ID.
+                st.markdown(f"**Team {i + 1}**")
+                st.markdown(f"<div style='display:flex;flex-wrap:wrap;'>{team_html}</div>", unsafe_allow_html=True)
 
 with tab2:
-    start_battle = st.button("🔴 INITIALIZE COMBAT", use_container_width=True)
+    col_start, col_instant = st.columns([3, 1])
+    start_battle = col_start.button("🔴 INITIALIZE COMBAT", use_container_width=True)
+    resolve_instantly = col_instant.button("⏩ RESOLVE INSTANTLY", use_container_width=True)
     show_log = st.checkbox("Show battle log", value=False)
 
     log_placeholder = st.empty()
     map_placeholder = st.empty()
     arena_placeholder = st.empty()
 
-    if start_battle:
-        # Battle State
-        sim_state = {
-            p['id']: {'hp': 100, 'en': 50, 'spawn_tick': 0, 'death_tick': None}
-            for p in players
-        }
-        p_team_map = {p['id']: i for i, tm in enumerate(teams_list) for p in tm}
-        positions = initialize_positions(teams_list, MAP_WIDTH, MAP_HEIGHT)
-
-        battle_active = True
-        tick = 0
-        logs = []
-
-        while battle_active:
-            tick += 1
-            alive_ids = [pid for pid, s in sim_state.items() if s['hp'] > 0]
-            alive_teams = set(p_team_map[pid] for pid in alive_ids)
-
-            active_attacker = None
-            active_victim = None
-            event_type = None
-
-            if len(alive_teams) <= 1:
-                battle_active = False
-                winner_idx = list(alive_teams)[0] if alive_teams else -1
-                msg = f"GAME OVER. TEAM {winner_idx + 1} VICTORY." if winner_idx != -1 else "DRAW. MUTUAL ANNIHILATION."
-                logs.append(f"<span style='color:#00ff00'> >> {msg}</span>")
+    host = get_battle_host()
+
+    def discard_sim(sim):
+        sim.recorder.close()
+        host.release_replay(sim.recorder.path)
+
+    # A profiled battle interrupted by a rerun is kept for one run, in case that run is RESOLVE INSTANTLY.
+    paused_sim = st.session_state.pop('paused_sim', None)
+    if paused_sim is not None and not (resolve_instantly and profile_loop):
+        discard_sim(paused_sim)
+        paused_sim = None
+
+    if start_battle or resolve_instantly:
+        combat = "simultaneous" if simultaneous_fire else "single"
+        keyframe_every = LARGE_KEYFRAME_EVERY if large_battle else DEFAULT_KEYFRAME_EVERY
+        tick_seconds = None if resolve_instantly else sim_speed
+        colors = team_colors(teams_list)
+        if large_battle:
+            templates = RenderTemplates(players, inline_colors=True)
+        log_view = PlaceholderWriter(log_placeholder)
+        map_view = PlaceholderWriter(map_placeholder)
+        arena_view = PlaceholderWriter(arena_placeholder)
+        views = (log_view, map_view, arena_view)
+
+        def start_sim():
+            ctx = SimContext(battle_seed or None)
+            if large_battle:
+                sim = BattleSimulator(
+                    players, teams_list, *map_size(len(players)), ctx=ctx, movement="array", combat=combat,
+                    area_effects=area_effects,
+                )
+            else:
+                sim = BattleSimulator(
+                    players, teams_list, MAP_WIDTH, MAP_HEIGHT, ctx=ctx, combat=combat, area_effects=area_effects
+                )
+            fd, replay_path = tempfile.mkstemp(suffix=".barreplay")
+            os.close(fd)
+            sim.recorder = ReplayWriter(replay_path, sim, keyframe_every)
+            return sim
+
+        def build_frame(sim, event, map_cache, arena_cache):
+            """(log, map, arena) HTML for one frame; shared by every viewer of a hosted battle."""
+            log_html = f'<div class="battle-log">{sim.log.html()}</div>'
+            if large_battle:
+                map_html = render_density_map(sim.state, event, colors, sim.width, sim.height)
+                sample = max(1, LARGE_ARENA_SAMPLE // len(teams_list))
+                arena_html = render_team_summary(teams_list, sim.state, event, colors, sample, arena_cache, templates)
             else:
-                step_positions(alive_ids, p_team_map, positions, MAP_WIDTH, MAP_HEIGHT)
-                for pid in alive_ids:
-                    sim_state[pid]['en'] = min(100, sim_state[pid]['en'] + 5)
-
-                att_id = random.choice(alive_ids)
-                att_team = p_team_map[att_id]
-                active_attacker = att_id
-
-                enemies = [pid for pid in alive_ids if p_team_map[pid] != att_team]
-                if enemies:
-                    vic_id = get_closest_enemy(att_id, alive_ids, p_team_map, positions) or random.choice(enemies)
-                    if vic_id is not None:
-                        dx = positions[vic_id]['x'] - positions[att_id]['x']
-                        dy = positions[vic_id]['y'] - positions[att_id]['y']
-                        dist = math.hypot(dx, dy)
-                        if dist <= FIRE_RANGE:
-                            active_victim = vic_id
-                            current_en = sim_state[att_id]['en']
-
-                            if current_en >= 100 and random.random() < 0.3:
-                                dmg = 9999
-                                sim_state[att_id]['en'] = 0
-                                event_type = "dgun"
-                                log_cls = "log-dgun"
-                                wpn_name = "D-GUN"
-                            else:
-                                dmg = random.randint(10, 25)
-                                sim_state[att_id]['en'] = max(0, current_en - 10)
-                                event_type = "attack"
-                                log_cls = ""
-                                wpn_name = "Laser"
-
-                            sim_state[vic_id]['hp'] -= dmg
-
-                            att_hex = next(p['hex'] for p in players if p['id'] == att_id)
-                            vic_hex = next(p['hex'] for p in players if p['id'] == vic_id)
-
-                            log_entry = (
-                                f"[{tick}] <span style='color:{att_hex}'>COM_{att_id}</span> "
-                                f"fires {wpn_name} >> <span style='color:{vic_hex}'>COM_{vic_id}</span> "
-                                f"(-{dmg} HP)"
-                            )
-
-                            if event_type == "dgun":
-                                log_entry = f"<span class='log-dgun'>{log_entry}</span>"
-
-                            if sim_state[vic_id]['hp'] <= 0:
-                                sim_state[vic_id]['hp'] = 0
-                                sim_state[vic_id]['death_tick'] = tick
-                                log_entry += " <span class='log-kill'>[COMBLAST]</span>"
-                                active_victim = vic_id
-                                event_type = "die"
-
-                            logs.append(log_entry)
-
-            if len(logs) > 50:
-                logs = logs[-50:]
+                map_html = render_battle_map(players, sim.state, event, map_cache, templates)
+                arena_html = render_arena(teams_list, sim.state, event, arena_cache, templates)
+            return log_html, map_html, arena_html
+
+        def push_frame(frame):
+            log_html, map_html, arena_html = frame
             if show_log:
-                reversed_logs = "<br>".join(logs[::-1])
-                log_placeholder.markdown(f'<div class="battle-log">{reversed_logs}</div>', unsafe_allow_html=True)
+                log_view.markdown(log_html)
             else:
-                log_placeholder.empty()
-
-            map_html = "<div class='rts-map'>"
-            for p in players:
-                pid = p['id']
-                s = sim_state[pid]
-                pos = positions[pid]
-                is_alive = s['hp'] > 0
-                death_tick = s['death_tick']
-                show_unit = is_alive or (death_tick is not None and (tick - death_tick) <= DEATH_FLASH_TICKS)
-                if not show_unit:
-                    continue
-
-                classes = ["unit-dot"]
-                if is_alive and (tick - s['spawn_tick']) <= SPAWN_FLASH_TICKS:
-                    classes.append("unit-spawn")
-                if is_alive and pid == active_attacker:
-                    classes.append("unit-attacker")
-                if is_alive and pid == active_victim:
-                    classes.append("unit-hit")
-                if not is_alive:
-                    classes.append("unit-dead")
-
-                if p['faction'] == "Cortex":
-                    radius = "0px"
-                elif p['faction'] == "Legion":
-                    radius = "50%"
+                log_view.empty()
+            map_view.markdown(map_html)
+            arena_view.markdown(arena_html)
+
+        def run_profiled():
+            if paused_sim is not None:
+                sim = paused_sim
+                profiler = sim.profiler
+            else:
+                sim = start_sim()
+                host.hold_replay(sim.recorder.path)
+                profiler = TickProfiler()
+                sim.profiler = profiler
+            map_cache = FragmentCache()
+            arena_cache = FragmentCache()
+            unit_cache = arena_cache if large_battle else map_cache
+            profile_view = PlaceholderWriter(profile_placeholder)
+
+            def draw(event):
+                profiler.mark()
+                units_before = unit_cache.served
+                rebuilt_before = unit_cache.rebuilt
+                bytes_before = sum(v.bytes_sent for v in views)
+                frame = build_frame(sim, event, map_cache, arena_cache)
+                profiler.lap("html", track="ui")
+                push_frame(frame)
+                profiler.lap("push", track="ui")
+                profiler.count("units_rendered", unit_cache.served - units_before)
+                profiler.count("units_rebuilt", unit_cache.rebuilt - rebuilt_before)
+                profiler.count("bytes_sent", sum(v.bytes_sent for v in views) - bytes_before)
+                profile_view.markdown(render_profile_summary(profiler.summary(last=PROFILE_WINDOW)))
+
+            try:
+                if resolve_instantly:
+                    # Step without collecting events; a large battle runs for tens of thousands of ticks.
+                    event = None
+                    while not sim.finished:
+                        event = sim.step()
+                    draw(event)
                 else:
-                    radius = "3px"
-
-                map_html += (
-                    f"<div class='{' '.join(classes)}' "
-                    f"style='left:{pos['x']:.1f}px; top:{pos['y']:.1f}px; "
-                    f"background:{p['hex']}; border-radius:{radius};'></div>"
+                    run_realtime(sim, sim_speed, draw, max_fps=MAX_RENDER_FPS)
+            except BaseException:
+                # Interrupted by a rerun; the next run resumes it headless or discards it.
+                st.session_state.paused_sim = sim
+                raise
+            sim.recorder.close()
+            st.session_state.profiler = profiler
+            return sim
+
+        sim = None
+        if profile_loop:
+            # Profiled battles run in this session's thread so the push phase can be timed too, but on a host slot.
+            try:
+                host.reserve_slot()
+            except HostBusy:
+                st.warning("Every battle slot on this server is busy. Try again in a moment.")
+                if paused_sim is not None:
+                    discard_sim(paused_sim)
+            else:
+                try:
+                    sim = run_profiled()
+                finally:
+                    host.release_slot()
+        else:
+            st.session_state.profiler = None
+            # Seeded battles are shared by everyone asking for the same one and outlive their last viewer
+            # for a moment; unseeded ones are private and stop once their viewer is gone. RESOLVE INSTANTLY
+            # fast-forwards the battle already running under the key, for every viewer of a shared one.
+            if battle_seed:
+                key = (
+                    st.session_state.roster_key, num_teams, split_method, battle_seed, combat, area_effects,
+                    large_battle,
                 )
-            map_html += "</div>"
-            map_placeholder.markdown(map_html, unsafe_allow_html=True)
-
-            arena_html = "<div style='display:flex; flex-wrap:wrap; gap:15px; justify-content:center;'>"
-            for t_idx, team in enumerate(teams_list):
-                team_alive = any(sim_state[p['id']]['hp'] > 0 for p in team)
-                opacity = "1.0" if team_alive else "0.3"
-                border_col = "#00ff00" if team_alive else "#333"
-
-                arena_html += f"<div style='flex:1; min-width:220px; border-top: 2px solid {border_col}; background:#111; padding:10px; opacity:{opacity}'>"
-                arena_html += f"<div class='faction-label'>TEAM {t_idx + 1}</div>"
-                arena_html += "<div style='display:flex; flex-wrap:wrap; justify-content:center;'>"
-
-                for p in team:
-                    pid = p['id']
-                    s = sim_state[pid]
-                    is_alive = s['hp'] > 0
-
-                    evt = None
-                    if is_alive and pid == active_attacker: evt = event_type if event_type == "dgun" else "attack"
-                    if is_alive and pid == active_victim: evt = "hit"
-                    if not is_alive and pid == active_victim and event_type == "die": evt = "die"
-
-                    arena_html += render_commander_box(p, s['hp'], s['en'], is_alive, evt, show_hud=True)
-
-                arena_html += "</div></div>"
-            arena_html += "</div>"
-            arena_placeholder.markdown(arena_html, unsafe_allow_html=True)
+                grace_seconds = SHARED_BATTLE_GRACE_SECONDS
+            else:
+                key = st.session_state.get('private_battle') if resolve_instantly else None
+                if key is None:
+                    key = st.session_state.private_battle = object()
+                grace_seconds = 0.0
+
+            def start_hosted():
+                map_cache = FragmentCache()
+                arena_cache = FragmentCache()
+                return start_sim(), lambda sim, event: build_frame(sim, event, map_cache, arena_cache)
+
+            async def watch(battle):
+                async for frame in battle.frames():
+                    push_frame(frame.payload)
+
+            try:
+                battle = host.join(key, start_hosted, tick_seconds, MAX_RENDER_FPS, grace_seconds)
+            except HostBusy:
+                st.warning("Every battle slot on this server is busy. Try again in a moment.")
+            else:
+                if resolve_instantly:
+                    battle.fast_forward()
+                try:
+                    asyncio.run(watch(battle))
+                    # The replay is complete once the worker has closed it.
+                    battle.done.wait()
+                except BaseException:
+                    host.leave(battle, keep_replay=False, grace_seconds=RERUN_GRACE_SECONDS)
+                    raise
+                host.leave(battle)
+                sim = battle.sim
+
+        if sim is not None:
+            # The host deletes a replay (and its GIF) once no session holds it.
+            old_replay = st.session_state.get('replay_path')
+            if old_replay:
+                host.release_replay(old_replay)
+            st.session_state.replay_path = sim.recorder.path
+            st.session_state.has_replay = True
+            st.session_state.replay_large = large_battle
+
+    profiler = st.session_state.get('profiler')
+    if profiler is not None:
+        profile_placeholder.markdown(render_profile_summary(profiler.summary()))
+        st.sidebar.download_button(
+            "Export Chrome trace", json.dumps(profiler.chrome_trace()), file_name="battle_trace.json"
+        )
 
-            time.sleep(sim_speed)
+    if st.session_state.get('has_replay') and not os.path.exists(st.session_state.replay_path):
+        # Replays past the host's replay_ttl are swept even while a session still shows them.
+        st.session_state.has_replay = False
+    if st.session_state.get('has_replay'):
+        st.subheader("📼 Replay")
+        replay = Replay(st.session_state.replay_path)
+        try:
+            if replay.ticks > 0:
+                replay_tick = st.slider("Replay tick", 0, replay.ticks, replay.ticks)
+            else:
+                replay_tick = 0
+            state, event, log = replay.frame(replay_tick)
+            if show_log:
+                st.markdown(f'<div class="battle-log">{log.html()}</div>', unsafe_allow_html=True)
+            if st.session_state.get('replay_large'):
+                colors = team_colors(replay.teams)
+                sample = max(1, LARGE_ARENA_SAMPLE // len(replay.teams))
+                st.markdown(render_density_map(state, event, colors, replay.width, replay.height), unsafe_allow_html=True)
+                st.markdown(render_team_summary(replay.teams, state, event, colors, sample), unsafe_allow_html=True)
+            else:
+                st.markdown(render_battle_map(replay.players, state, event), unsafe_allow_html=True)
+                st.markdown(render_arena(replay.teams, state, event), unsafe_allow_html=True)
+        finally:
+            replay.close()
+        col_replay, col_gif = st.columns(2)
+        with open(st.session_state.replay_path, "rb") as replay_file:
+            col_replay.download_button("Download replay", replay_file.read(), file_name="battle.barreplay")
+        if col_gif.button("Export GIF"):
+            from export import export_replay
+
+            gif_path = os.path.splitext(st.session_state.replay_path)[0] + ".gif"
+            replay = Replay(st.session_state.replay_path)
+            try:
+                with st.spinner("Rendering GIF..."):
+                    # Large maps are scaled down to the default map's width.
+                    scale = min(1.0, MAP_WIDTH / replay.width)
+                    export_replay(replay, gif_path, ticks_per_frame=GIF_TICKS_PER_FRAME, scale=scale)
+            finally:
+                replay.close()
+            with open(gif_path, "rb") as gif_file:
+                col_gif.download_button("Download GIF", gif_file.read(), file_name="battle.gif", mime="image/gif")
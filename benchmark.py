@@ -0,0 +1,363 @@
+"""
+Benchmarks for the lobby, simulation and rendering hot paths.
+
+Every benchmark runs over a grid of commander and team counts and records
+the median and best time per call, peak traced memory (None for the cases
+run in a child interpreter) and, for renderers, the HTML size. Results go
+to a JSON file so two commits can be compared:
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json --compare before.json
+
+Above 100 commanders the map grows with the commander count (simulation's
+map_size) so unit density stays at what the app shows for 100. The startup
+benchmarks time fresh interpreters, so they run once rather than per size.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from lobby import (
+    COMMON_COLORS,
+    generate_distinct_colors,
+    initialize_commanders,
+    partition_teams,
+    sort_players_perceptually,
+)
+from render import RenderTemplates, render_arena, render_battle_map, render_commander_box
+from rng import SimContext
+from simulation import (
+    COMBLAST_RADIUS,
+    BattleSimulator,
+    SpatialGrid,
+    enemy_grid_cell_size,
+    get_closest_enemy,
+    initialize_positions,
+    map_size,
+    step_positions,
+)
+
+DEFAULT_COMMANDERS = [32, 100, 1000, 10000]
+DEFAULT_TEAMS = [2, 5, 10]
+# Modules the CLI tools and the app's worker threads load; none may pull in Streamlit.
+HEADLESS_MODULES = ["lobby", "simulation", "render", "replay", "export", "hosting", "tournament"]
+HERE = os.path.dirname(os.path.abspath(__file__))
+REGRESSION_RATIO = 1.2
+
+# ---------------------------------------------------------
+# 1. FIXTURES
+# ---------------------------------------------------------
+
+def make_lobby(commanders, num_teams, seed):
+    ctx = SimContext(seed)
+    players = initialize_commanders(commanders, rng=ctx.lobby)
+    teams = partition_teams(players, num_teams)
+    return ctx, players, teams
+
+
+def make_battle(commanders, num_teams, seed, warmup_ticks=5, movement="grid"):
+    ctx, players, teams = make_lobby(commanders, num_teams, seed)
+    width, height = map_size(commanders)
+    sim = BattleSimulator(players, teams, width, height, ctx=ctx, movement=movement)
+    event = None
+    for _ in range(warmup_ticks):
+        event = sim.step()
+    return sim, event
+
+# ---------------------------------------------------------
+# 2. BENCHMARKS
+# ---------------------------------------------------------
+# Each benchmark does its setup and returns (call, extra): call is timed
+# repeatedly, extra holds metrics that do not depend on timing.
+
+def bench_lobby(commanders, num_teams, seed):
+    seeds = itertools.count(seed)
+    return lambda: make_lobby(commanders, num_teams, next(seeds)), {}
+
+
+def bench_distinct_colors(commanders, num_teams, seed):
+    ctx = SimContext(seed)
+    return lambda: generate_distinct_colors(COMMON_COLORS, commanders, ctx.lobby), {}
+
+
+def bench_sort_players(commanders, num_teams, seed):
+    _, players, _ = make_lobby(commanders, num_teams, seed)
+    return lambda: sort_players_perceptually(players), {}
+
+
+def bench_partition_teams(commanders, num_teams, seed):
+    _, players, _ = make_lobby(commanders, num_teams, seed)
+    return lambda: partition_teams(players, num_teams), {}
+
+
+def bench_step_positions(commanders, num_teams, seed):
+    _, players, teams = make_lobby(commanders, num_teams, seed)
+    width, height = map_size(commanders)
+    spawn = initialize_positions(teams, width, height, rng=SimContext(seed).spawn)
+    p_team_map = {p['id']: t_idx for t_idx, tm in enumerate(teams) for p in tm}
+    alive_ids = list(p_team_map)
+
+    def call():
+        # Always step from the spawn layout so repeats measure the same tick.
+        positions = {pid: dict(pos) for pid, pos in spawn.items()}
+        step_positions(alive_ids, p_team_map, positions, width, height)
+
+    return call, {}
+
+
+def bench_closest_enemy(commanders, num_teams, seed):
+    _, players, teams = make_lobby(commanders, num_teams, seed)
+    width, height = map_size(commanders)
+    positions = initialize_positions(teams, width, height, rng=SimContext(seed).spawn)
+    p_team_map = {p['id']: t_idx for t_idx, tm in enumerate(teams) for p in tm}
+    alive_ids = list(p_team_map)
+    xs = {pid: positions[pid]['x'] for pid in alive_ids}
+    ys = {pid: positions[pid]['y'] for pid in alive_ids}
+
+    def call():
+        # One tick's worth of targeting: rebuild the grid, query every unit.
+        grid = SpatialGrid(enemy_grid_cell_size(len(alive_ids), width, height))
+        grid.rebuild(alive_ids, p_team_map, xs, ys)
+        for pid in alive_ids:
+            get_closest_enemy(pid, alive_ids, p_team_map, positions, grid)
+
+    return call, {"queries": len(alive_ids)}
+
+
+def bench_sim_tick(commanders, num_teams, seed, movement="grid"):
+    battle = {"sim": make_battle(commanders, num_teams, seed, movement=movement)[0], "seed": seed}
+
+    def call():
+        if battle["sim"].finished:
+            battle["seed"] += 1
+            battle["sim"] = make_battle(commanders, num_teams, battle["seed"], movement=movement)[0]
+        battle["sim"].step()
+
+    return call, {}
+
+
+def bench_sim_tick_array(commanders, num_teams, seed):
+    return bench_sim_tick(commanders, num_teams, seed, movement="array")
+
+
+def bench_area_queries(commanders, num_teams, seed, movement="grid"):
+    sim, _ = make_battle(commanders, num_teams, seed, movement=movement)
+    index = sim.grid if movement == "grid" else sim.engine
+    state = sim.state
+    centers = [(state.x[i], state.y[i]) for i in state.alive]
+
+    def call():
+        # One comblast-radius query around every living unit.
+        for x, y in centers:
+            index.within(x, y, COMBLAST_RADIUS)
+
+    return call, {"queries": len(centers)}
+
+
+def bench_area_queries_array(commanders, num_teams, seed):
+    return bench_area_queries(commanders, num_teams, seed, movement="array")
+
+
+def bench_render_frame(commanders, num_teams, seed):
+    sim, event = make_battle(commanders, num_teams, seed)
+    # Templates are built once per lobby; the frame itself starts from empty fragment caches.
+    templates = RenderTemplates(sim.players)
+
+    def call():
+        return (
+            templates.css
+            + render_battle_map(sim.players, sim.state, event, templates=templates)
+            + render_arena(sim.teams, sim.state, event, templates=templates)
+        )
+
+    return call, {"html_bytes": len(call().encode("utf-8"))}
+
+
+def bench_commander_boxes(commanders, num_teams, seed):
+    _, players, _ = make_lobby(commanders, num_teams, seed)
+    boxes = RenderTemplates(players).boxes
+
+    def call():
+        return "".join(render_commander_box(p, 100, 100, True, show_hud=False, template=boxes[p['id']]) for p in players)
+
+    return call, {"html_bytes": len(call().encode("utf-8"))}
+
+
+def run_python(code):
+    subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True, capture_output=True)
+
+
+def bench_cold_import(commanders, num_teams, seed):
+    code = f"import {', '.join(HEADLESS_MODULES)}, sys; assert 'streamlit' not in sys.modules"
+    # tracemalloc cannot see into the child interpreter, so no peak is recorded.
+    return lambda: run_python(code), {"peak_bytes": None}
+
+
+def bench_app_first_run(commanders, num_teams, seed):
+    # A new interpreter running app.py once: what the first page load of a fresh server costs.
+    code = "from streamlit.testing.v1 import AppTest; AppTest.from_file('app.py', default_timeout=120).run()"
+    return lambda: run_python(code), {"peak_bytes": None}
+
+
+# (name, function, what the case varies with: "teams", "commanders" or None for run-once cases)
+BENCHMARKS = [
+    ("lobby", bench_lobby, "teams"),
+    ("distinct_colors", bench_distinct_colors, "commanders"),
+    ("sort_players", bench_sort_players, "commanders"),
+    ("partition_teams", bench_partition_teams, "teams"),
+    ("step_positions", bench_step_positions, "teams"),
+    ("closest_enemy", bench_closest_enemy, "teams"),
+    ("sim_tick", bench_sim_tick, "teams"),
+    ("sim_tick_array", bench_sim_tick_array, "teams"),
+    ("area_query", bench_area_queries, "commanders"),
+    ("area_query_array", bench_area_queries_array, "commanders"),
+    ("render_frame", bench_render_frame, "teams"),
+    ("commander_boxes", bench_commander_boxes, "commanders"),
+    ("cold_import", bench_cold_import, None),
+    ("app_first_run", bench_app_first_run, None),
+]
+
+# ---------------------------------------------------------
+# 3. HARNESS
+# ---------------------------------------------------------
+
+def time_calls(call, min_time, min_repeats=3, max_repeats=50):
+    """
+    Times call until min_time has passed and it ran min_repeats times. A
+    single call slower than min_time is enough on its own, so 10,000-unit
+    cases do not take minutes each.
+    """
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_repeats:
+        t0 = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time and (len(times) >= min_repeats or times[0] >= min_time):
+            break
+    return times
+
+
+def peak_memory(call):
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(commanders_list, teams_list, names=None, seed=0, min_time=0.5, log=print):
+    results = []
+    for name, bench, varies in BENCHMARKS:
+        if names and name not in names:
+            continue
+        for commanders in (commanders_list if varies else [None]):
+            for num_teams in (teams_list if varies == "teams" else teams_list[:1]):
+                if commanders is not None and num_teams > commanders:
+                    continue
+                call, extra = bench(commanders, num_teams, seed)
+                times = time_calls(call, min_time)
+                result = {
+                    "name": name,
+                    "commanders": commanders,
+                    "teams": num_teams if varies == "teams" else None,
+                    "median_s": statistics.median(times),
+                    "min_s": min(times),
+                    "repeats": len(times),
+                    **extra,
+                }
+                if "peak_bytes" not in result:
+                    result["peak_bytes"] = peak_memory(call)
+                results.append(result)
+                log(format_result(result))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=HERE,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def result_key(result):
+    return result["name"], result["commanders"], result["teams"]
+
+
+def format_result(result):
+    teams = f"{result['teams']:>3} teams" if result["teams"] is not None else " " * 9
+    commanders = f"{result['commanders']:>6} cmdrs" if result["commanders"] is not None else " " * 12
+    peak = f"{result['peak_bytes'] / 1024:9.1f} KiB" if result["peak_bytes"] is not None else f"{'n/a':>13}"
+    line = f"{result['name']:<16} {commanders} {teams}  median {result['median_s'] * 1e3:9.3f} ms  peak {peak}"
+    if "html_bytes" in result:
+        line += f"  html {result['html_bytes'] / 1024:8.1f} KiB"
+    return line
+
+
+def compare(results, baseline):
+    """
+    Prints the median-time ratio against a previous results file and returns
+    the entries that got slower by more than REGRESSION_RATIO.
+    """
+    before = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline['environment'].get('commit') or 'baseline'}:")
+    for r in results:
+        old = before.get(result_key(r))
+        if old is None:
+            continue
+        ratio = r["median_s"] / old["median_s"] if old["median_s"] else float("inf")
+        flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+        print(f"  {r['name']:<16} {r['commanders'] or '':>6} {r['teams'] or '':>3}  x{ratio:5.2f}{flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the BAR Commander Simulator hot paths.")
+    parser.add_argument("--commanders", type=int, nargs="+", default=DEFAULT_COMMANDERS)
+    parser.add_argument("--teams", type=int, nargs="+", default=DEFAULT_TEAMS)
+    parser.add_argument("--only", nargs="+", default=None, choices=[name for name, _, _ in BENCHMARKS])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend timing each case")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.commanders, args.teams, args.only, args.seed, args.min_time)
+    with open(args.out, "w") as handle:
+        json.dump({"environment": environment(), "results": results}, handle, indent=2)
+    print(f"\nWrote {len(results)} results to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
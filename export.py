@@ -0,0 +1,290 @@
+"""
+Headless export of battles to animated GIF or MP4.
+
+Frames are rasterized straight into a NumPy pixel buffer that mimics the
+app's rts-map view (grid background, one 12px dot per commander shaped by
+faction, attacker and hit rings, fading deaths) and handed to the writer one
+at a time, so memory stays flat however long the battle is:
+
+    python export.py battle.barreplay highlights.gif --fps 20
+    python export.py --seed 7 --commanders 100 --teams 4 battle.mp4
+
+GIFs are written incrementally with Pillow. MP4 goes through matplotlib's
+FFMpegWriter and needs ffmpeg on the PATH.
+"""
+
+import argparse
+
+import numpy as np
+
+from lobby import commander_color, initialize_commanders, partition_teams
+from replay import Replay
+from rng import SimContext
+from simulation import DEATH_FLASH_TICKS, NO_TICK, BattleSimulator
+
+# ---------------------------------------------------------
+# 1. RASTERIZER
+# ---------------------------------------------------------
+
+BACKGROUND = (5, 5, 5)
+GRID_SPACING = 30
+ATTACKER_RING = (0, 255, 255)
+HIT_RING = (255, 68, 68)
+DOT_SIZE = 12
+
+
+def _stamp(shape, size):
+    """(dy, dx, is_border) offsets of a unit dot centered on its position."""
+    half = size / 2
+    yy, xx = np.mgrid[0:size, 0:size] + 0.5 - half
+    if shape == "Legion":
+        inside = xx ** 2 + yy ** 2 <= half ** 2
+        border = inside & (xx ** 2 + yy ** 2 > (half - 1) ** 2)
+    else:
+        corner = 0.0 if shape == "Cortex" else 3.0
+        cx = np.maximum(np.abs(xx) - (half - corner), 0)
+        cy = np.maximum(np.abs(yy) - (half - corner), 0)
+        inside = cx ** 2 + cy ** 2 <= corner ** 2 if corner else np.ones_like(xx, dtype=bool)
+        edge = (np.abs(xx) > half - 1) | (np.abs(yy) > half - 1)
+        border = inside & edge
+    dy, dx = np.nonzero(inside)
+    offset = int(half)
+    return dy - offset, dx - offset, border[dy, dx]
+
+
+def _ring(radius, width=2):
+    size = 2 * radius + 1
+    yy, xx = np.mgrid[0:size, 0:size] - radius
+    dist = np.hypot(xx, yy)
+    dy, dx = np.nonzero((dist <= radius) & (dist > radius - width))
+    return dy - radius, dx - radius
+
+
+class MapRasterizer:
+    """
+    Draws BattleState frames as (height, width, 3) uint8 arrays. Dots are
+    stamped with vectorized fancy indexing one faction at a time, so even a
+    10,000-unit frame costs tens of milliseconds.
+    """
+
+    def __init__(self, players, width, height, scale=1.0):
+        self.scale = scale
+        self.width = max(1, int(round(width * scale)))
+        self.height = max(1, int(round(height * scale)))
+        self.background = self._background()
+        self.frame = np.empty_like(self.background)
+
+        rgb = np.array([commander_color(p).rgb for p in players]) * 255
+        self.fill = rgb.astype(np.uint8)
+        # The dot's 1px border is rgba(255,255,255,0.4) over its own color.
+        self.border = (rgb * 0.6 + 255 * 0.4).astype(np.uint8)
+        factions = np.array([p['faction'] for p in players])
+        # Per faction: its units, its dot stamp and each unit's per-pixel colors.
+        self.shapes = []
+        for faction in sorted(set(factions.tolist())):
+            members = np.flatnonzero(factions == faction)
+            dy, dx, is_border = _stamp(faction, DOT_SIZE)
+            colors = np.where(is_border[None, :, None], self.border[members][:, None, :], self.fill[members][:, None, :])
+            self.shapes.append((members, dy, dx, colors))
+        self.attacker_ring = _ring(9)
+        self.hit_ring = _ring(8)
+
+    def _background(self):
+        h, w = self.height, self.width
+        yy, xx = np.mgrid[0:h, 0:w].astype(np.float64)
+        img = np.empty((h, w, 3))
+        img[:] = BACKGROUND
+        # The two faint radial glows of the CSS background.
+        reach = 0.4 * np.hypot(w, h)
+        for (fx, fy), color in (((0.2, 0.2), (0, 255, 255)), ((0.8, 0.8), (255, 68, 68))):
+            glow = np.clip(1 - np.hypot(xx - fx * w, yy - fy * h) / reach, 0, 1) * 0.06
+            img += glow[:, :, None] * (np.array(color) - img)
+        step = GRID_SPACING * self.scale
+        lines = (np.floor(xx % step) == 0) | (np.floor(yy % step) == 0)
+        img[lines] += 0.04 * (255 - img[lines])
+        return img.astype(np.uint8)
+
+    def _blit(self, idx, dy, dx, colors, alpha=None):
+        """Stamps offsets (dy, dx) around every unit in idx; colors is per unit or per (unit, offset)."""
+        if len(idx) == 0:
+            return
+        px = np.rint(self.xs[idx] * self.scale).astype(np.int64)[:, None] + dx[None, :]
+        py = np.rint(self.ys[idx] * self.scale).astype(np.int64)[:, None] + dy[None, :]
+        keep = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        colors = np.broadcast_to(colors if colors.ndim == 3 else colors[:, None, :], px.shape + (3,))
+        px, py, colors = px[keep], py[keep], colors[keep]
+        if alpha is not None:
+            a = np.broadcast_to(alpha[:, None], keep.shape)[keep][:, None]
+            colors = (self.frame[py, px] * (1 - a) + colors * a).astype(np.uint8)
+        self.frame[py, px] = colors
+
+    def draw(self, state, event, tick=None):
+        tick = event.tick if tick is None else tick
+        self.frame[:] = self.background
+        self.xs = np.frombuffer(state.x, dtype=np.float64)
+        self.ys = np.frombuffer(state.y, dtype=np.float64)
+        hp = np.frombuffer(state.hp, dtype=np.int32)
+        death = np.frombuffer(state.death_tick, dtype=np.int32)
+
+        alive = hp > 0
+        since_death = tick - death
+        dying = ~alive & (death != NO_TICK) & (since_death <= DEATH_FLASH_TICKS)
+        fade = 1 - since_death / (DEATH_FLASH_TICKS + 1)
+
+        for members, dy, dx, colors in self.shapes:
+            shown = alive[members] | dying[members]
+            solid = shown & ~dying[members]
+            fading = shown & dying[members]
+            self._blit(members[solid], dy, dx, colors[solid])
+            self._blit(members[fading], dy, dx, colors[fading], alpha=fade[members[fading]])
+
+        for unit_id, ring, color in (
+            (event.attacker, self.attacker_ring, ATTACKER_RING),
+            (event.victim, self.hit_ring, HIT_RING),
+        ):
+            if unit_id is not None:
+                i = state.index[unit_id]
+                if alive[i]:
+                    self._blit(np.array([i]), ring[0], ring[1], np.array([color], dtype=np.uint8))
+        return self.frame
+
+# ---------------------------------------------------------
+# 2. WRITERS
+# ---------------------------------------------------------
+
+class GifWriter:
+    """
+    Appends frames to an animated GIF as they arrive. Each frame gets its
+    own 256-color palette, so large rosters keep their colors.
+    """
+
+    def __init__(self, path, fps):
+        self.handle = open(path, "wb")
+        self.duration = int(round(1000 / fps))
+        self.started = False
+
+    def write(self, frame):
+        from PIL import GifImagePlugin, Image
+
+        im = Image.fromarray(frame).quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        if not self.started:
+            header, _ = GifImagePlugin.getheader(im, info={"loop": 0})
+            self.handle.write(b"".join(header))
+            self.started = True
+        for chunk in GifImagePlugin.getdata(im, duration=self.duration, include_color_table=True):
+            self.handle.write(chunk)
+
+    def close(self):
+        self.handle.write(b";")
+        self.handle.close()
+
+
+class Mp4Writer:
+    """
+    Pipes frames to ffmpeg through matplotlib's FFMpegWriter, one figure
+    redraw per frame with the image artist's data swapped in place.
+    """
+
+    def __init__(self, path, fps, width, height):
+        from matplotlib.animation import FFMpegWriter
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        if not FFMpegWriter.isAvailable():
+            raise RuntimeError("MP4 export needs ffmpeg on the PATH; export a .gif instead")
+        dpi = 100
+        self.fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        ax = self.fig.add_axes((0, 0, 1, 1))
+        ax.set_axis_off()
+        self.image = ax.imshow(np.zeros((height, width, 3), dtype=np.uint8), interpolation="nearest")
+        self.writer = FFMpegWriter(fps=fps, codec="libx264", extra_args=["-pix_fmt", "yuv420p"])
+        self.writer.setup(self.fig, path, dpi=dpi)
+
+    def write(self, frame):
+        self.image.set_data(frame)
+        self.writer.grab_frame()
+
+    def close(self):
+        self.writer.finish()
+
+
+def open_writer(path, fps, width, height):
+    if path.lower().endswith(".gif"):
+        return GifWriter(path, fps)
+    return Mp4Writer(path, fps, width, height)
+
+# ---------------------------------------------------------
+# 3. EXPORT
+# ---------------------------------------------------------
+
+def battle_frames(sim, ticks_per_frame=1, max_ticks=None):
+    """Steps sim to the end, yielding (state, event) every ticks_per_frame ticks and at the end."""
+    while not sim.finished and (max_ticks is None or sim.tick < max_ticks):
+        event = sim.step()
+        if event.tick % ticks_per_frame == 0 or sim.finished:
+            yield sim.state, event
+
+
+def replay_frames(replay, ticks_per_frame=1):
+    ticks = list(range(ticks_per_frame, replay.ticks + 1, ticks_per_frame))
+    if replay.ticks and (not ticks or ticks[-1] != replay.ticks):
+        ticks.append(replay.ticks)
+    for tick in ticks:
+        yield replay.state_at(tick), replay.event_at(tick)
+
+
+def export_frames(frames, players, width, height, path, fps=20, scale=1.0):
+    """
+    Rasterizes and writes frames one at a time; returns the frame count.
+    """
+    raster = MapRasterizer(players, width, height, scale)
+    writer = open_writer(path, fps, raster.width, raster.height)
+    count = 0
+    try:
+        for state, event in frames:
+            writer.write(raster.draw(state, event))
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+
+def export_battle(sim, path, fps=20, ticks_per_frame=1, scale=1.0, max_ticks=None):
+    frames = battle_frames(sim, ticks_per_frame, max_ticks)
+    return export_frames(frames, sim.players, sim.width, sim.height, path, fps, scale)
+
+
+def export_replay(replay, path, fps=20, ticks_per_frame=1, scale=1.0):
+    frames = replay_frames(replay, ticks_per_frame)
+    return export_frames(frames, replay.players, replay.width, replay.height, path, fps, scale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a BAR Commander battle to GIF or MP4.")
+    parser.add_argument("source", nargs="?", help="replay file; omit to fight a fresh battle")
+    parser.add_argument("out", help=".gif or .mp4 path")
+    parser.add_argument("--seed", type=int, default=None, help="battle seed when no replay is given")
+    parser.add_argument("--commanders", type=int, default=32)
+    parser.add_argument("--teams", type=int, default=2)
+    parser.add_argument("--fps", type=int, default=20)
+    parser.add_argument("--ticks-per-frame", type=int, default=1)
+    parser.add_argument("--scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.source:
+        replay = Replay(args.source)
+        try:
+            count = export_replay(replay, args.out, args.fps, args.ticks_per_frame, args.scale)
+        finally:
+            replay.close()
+    else:
+        ctx = SimContext(args.seed)
+        players = initialize_commanders(args.commanders, rng=ctx.lobby)
+        sim = BattleSimulator(players, partition_teams(players, args.teams), ctx=ctx)
+        count = export_battle(sim, args.out, args.fps, args.ticks_per_frame, args.scale)
+    print(f"Wrote {count} frames to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
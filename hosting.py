@@ -0,0 +1,324 @@
+"""
+Server-wide battle hosting for the app.
+
+A BattleHost runs battles on one shared thread pool instead of in each
+browser session's script thread, and viewers watch them through asyncio:
+
+    host = BattleHost(max_battles=8)
+    battle = host.join(key, start, tick_seconds=0.1)
+    async for frame in battle.frames():
+        show(frame)
+
+Every session asking for the same key while that battle runs is handed the
+same HostedBattle, so a seeded battle watched by many viewers is simulated
+and rendered once. join() refuses new battles past max_battles, which bounds
+the simulation work however many sessions are open.
+
+Each join() is matched by a leave(). A battle nobody watches any more is
+stopped, straight away or after its grace period, and gives its slot back.
+The host also owns the battles' replay files: a session holds a replay for
+as long as it shows it, and the file is deleted once no session holds it or
+it is older than replay_ttl.
+"""
+
+import asyncio
+import glob
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from simulation import run_realtime
+
+DEFAULT_MAX_BATTLES = 8
+DEFAULT_REPLAY_TTL = 3600.0
+
+# One published frame. payload is whatever the battle's render callable
+# returned; error is set on the last frame when the battle crashed.
+Frame = namedtuple("Frame", ["seq", "payload", "finished", "error"])
+
+
+class HostBusy(RuntimeError):
+    """Raised by BattleHost.join when max_battles battles are already running."""
+
+
+def _offer(queue, frame):
+    # Viewers only ever want the newest frame; one still waiting is stale.
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(frame)
+
+
+def _delete_replay(path):
+    # Exports are written next to the replay under the same name (battle.gif).
+    stem = os.path.splitext(path)[0]
+    for name in [path] + glob.glob(glob.escape(stem) + ".*"):
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+class HostedBattle:
+    """
+    One simulation on a pool thread, fanning its frames out to any number of
+    asyncio viewers. render(sim, event) builds a frame's payload once for
+    all of them. tick_seconds of None resolves the battle as fast as
+    possible and publishes only the final frame; fast_forward() switches a
+    running battle to that. Setting stop abandons the battle between ticks.
+    """
+
+    def __init__(self, key, sim, render, tick_seconds, max_fps, grace_seconds=0.0):
+        self.key = key
+        self.sim = sim
+        self.render = render
+        self.tick_seconds = tick_seconds
+        self.max_fps = max_fps
+        self.grace_seconds = grace_seconds
+        self.replay_path = sim.recorder.path if sim.recorder is not None else None
+        self.lock = threading.Lock()
+        self.latest = None
+        self.subscribers = set()
+        self.viewers = 0
+        self.finished = False
+        self.stop = threading.Event()
+        self.headless = threading.Event()
+        self.done = threading.Event()
+        self.on_finish = None
+
+    def run(self):
+        sim = self.sim
+        error = None
+        try:
+            if self.tick_seconds is not None:
+                run_realtime(sim, self.tick_seconds, self._publish, self.max_fps, stop=self._interrupted)
+            if not sim.finished:
+                # Instant and fast-forwarded battles: the remaining ticks run unrendered.
+                event = None
+                while not sim.finished and not self.stop.is_set():
+                    event = sim.step()
+                if sim.finished:
+                    self._publish(event)
+        except Exception as exc:
+            error = exc
+        finally:
+            if sim.recorder is not None:
+                sim.recorder.close()
+            if error is not None:
+                self._publish_frame(None, error)
+            self.done.set()
+            if self.on_finish is not None:
+                self.on_finish(self)
+
+    def fast_forward(self):
+        """Runs the rest of the battle headless; viewers get only the final frame."""
+        self.headless.set()
+
+    def _interrupted(self):
+        return self.stop.is_set() or self.headless.is_set()
+
+    def _publish(self, event):
+        self._publish_frame(self.render(self.sim, event), None)
+
+    def _publish_frame(self, payload, error):
+        with self.lock:
+            seq = self.latest.seq + 1 if self.latest is not None else 1
+            self.finished = self.sim.finished or error is not None
+            self.latest = Frame(seq, payload, self.finished, error)
+            subscribers = list(self.subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, self.latest)
+            except RuntimeError:
+                # The viewer's event loop is gone; it unsubscribes as it unwinds.
+                pass
+
+    async def frames(self):
+        """
+        Yields this battle's frames to one viewer: the latest frame right
+        away, then each newer one until the final frame. A viewer that falls
+        behind skips straight to the newest frame.
+        """
+        queue = asyncio.Queue(maxsize=1)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            frame = self.latest
+            self.subscribers.add(subscriber)
+        try:
+            while True:
+                if frame is None:
+                    frame = await queue.get()
+                if frame.error is not None:
+                    raise RuntimeError("battle worker failed") from frame.error
+                yield frame
+                if frame.finished:
+                    return
+                frame = None
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
+
+
+class BattleHost:
+    """
+    Shared by every session of a server (the app keeps one in
+    st.cache_resource). Battles stay joinable by key while they run;
+    finished and stopped ones are dropped so the same key starts afresh.
+    """
+
+    def __init__(self, max_battles=DEFAULT_MAX_BATTLES, replay_ttl=DEFAULT_REPLAY_TTL):
+        self.max_battles = max_battles
+        self.replay_ttl = replay_ttl
+        self.pool = ThreadPoolExecutor(max_workers=max_battles, thread_name_prefix="battle")
+        self.lock = threading.Lock()
+        # key -> HostedBattle, or a threading.Event while start() is still building it.
+        self.battles = {}
+        self.slots = 0
+        # replay path -> [sessions holding it, time it was created]
+        self.replays = {}
+        self.recording = set()
+
+    def running(self):
+        with self.lock:
+            return self.slots
+
+    def join(self, key, start, tick_seconds, max_fps=20, grace_seconds=0.0):
+        """
+        Returns the running battle for key, or starts one from start(), which
+        returns (sim, render). The caller becomes one of its viewers and a
+        holder of its replay until leave(). Once the last viewer leaves, the
+        battle is stopped after grace_seconds. Raises HostBusy when
+        max_battles are running.
+        """
+        while True:
+            with self.lock:
+                self._expire_replays()
+                battle = self.battles.get(key)
+                if battle is None:
+                    if self.slots >= self.max_battles:
+                        raise HostBusy(f"all {self.max_battles} battle slots are in use")
+                    self.slots += 1
+                    building = self.battles[key] = threading.Event()
+                    break
+                if isinstance(battle, HostedBattle):
+                    battle.viewers += 1
+                    self._hold(battle.replay_path)
+                    return battle
+            # Another session is building this battle; join it once it is published.
+            battle.wait()
+
+        # The sim is built outside the host lock so other sessions are not held up by it.
+        try:
+            sim, render = start()
+        except BaseException:
+            with self.lock:
+                del self.battles[key]
+                self.slots -= 1
+            building.set()
+            raise
+        battle = HostedBattle(key, sim, render, tick_seconds, max_fps, grace_seconds)
+        battle.on_finish = self._finished
+        battle.viewers = 1
+        with self.lock:
+            self.battles[key] = battle
+            if battle.replay_path is not None:
+                self.recording.add(battle.replay_path)
+                self._hold(battle.replay_path)
+        building.set()
+        self.pool.submit(battle.run)
+        return battle
+
+    def reserve_slot(self):
+        """
+        Takes a battle slot for work run outside the host, such as a profiled
+        battle in a session's own thread. Raises HostBusy like join(); pair
+        with release_slot().
+        """
+        with self.lock:
+            if self.slots >= self.max_battles:
+                raise HostBusy(f"all {self.max_battles} battle slots are in use")
+            self.slots += 1
+
+    def release_slot(self):
+        with self.lock:
+            self.slots -= 1
+
+    def leave(self, battle, keep_replay=True, grace_seconds=0.0):
+        """
+        Ends one join(). keep_replay=False also lets go of the battle's
+        replay, for a viewer that never got to show it. grace_seconds
+        extends the battle's own grace period, for a viewer that may come
+        straight back.
+        """
+        with self.lock:
+            battle.viewers -= 1
+            if not keep_replay:
+                self._release(battle.replay_path)
+            if battle.viewers or battle.done.is_set():
+                return
+            grace_seconds = max(grace_seconds, battle.grace_seconds)
+            if not grace_seconds:
+                self._stop(battle)
+                return
+        timer = threading.Timer(grace_seconds, self._stop_unwatched, (battle,))
+        timer.daemon = True
+        timer.start()
+
+    def hold_replay(self, path):
+        """Registers a replay written outside the host, held by the caller."""
+        with self.lock:
+            self._hold(path)
+
+    def release_replay(self, path):
+        """Lets go of a replay; it is deleted once no session holds it."""
+        with self.lock:
+            self._release(path)
+
+    def _hold(self, path):
+        if path is None:
+            return
+        entry = self.replays.setdefault(path, [0, time.monotonic()])
+        entry[0] += 1
+
+    def _release(self, path):
+        entry = self.replays.get(path)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if entry[0] <= 0 and path not in self.recording:
+            del self.replays[path]
+            _delete_replay(path)
+
+    def _expire_replays(self):
+        # Sessions that end never release their replay, so old ones are swept here.
+        cutoff = time.monotonic() - self.replay_ttl
+        for path, (holders, created) in list(self.replays.items()):
+            if created < cutoff and path not in self.recording:
+                del self.replays[path]
+                _delete_replay(path)
+
+    def _stop_unwatched(self, battle):
+        with self.lock:
+            if not battle.viewers:
+                self._stop(battle)
+
+    def _stop(self, battle):
+        if self.battles.get(battle.key) is battle:
+            del self.battles[battle.key]
+        battle.stop.set()
+
+    def _finished(self, battle):
+        with self.lock:
+            if self.battles.get(battle.key) is battle:
+                del self.battles[battle.key]
+            self.slots -= 1
+            path = battle.replay_path
+            self.recording.discard(path)
+            entry = self.replays.get(path)
+            if entry is not None and entry[0] <= 0:
+                del self.replays[path]
+                _delete_replay(path)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,366 @@
+"""
+Commander lobby: roster generation, colors and team assignment.
+
+Streamlit-free so the UI, batch tools and benchmarks share one definition of
+how a lobby is rolled and split into teams.
+"""
+
+import colorsys
+import hashlib
+import math
+import random
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# ---------------------------------------------------------
+# 1. CONSTANTS & DATA
+# ---------------------------------------------------------
+
+COMMON_COLORS = [
+    "#FF0000", "#0000FF", "#00FF00", "#FFFF00", "#800080", "#FFA500", "#00FFFF", "#FF00FF",
+    "#FFFFFF", "#808080", "#A52A2A", "#FFC0CB", "#008080", "#E6E6FA", "#40E0D0",
+    "#800000", "#000080", "#808000", "#C0C0C0", "#FFD700", "#4B0082", "#FA8072", "#98FB98",
+    "#DC143C", "#00BFFF", "#B22222", "#FF7F50", "#2E8B57", "#DDA0DD", "#F0E68C", "#708090"
+]
+
+# UPDATED: Added Legion
+FACTIONS = ["Armada", "Cortex", "Legion"]
+
+# ---------------------------------------------------------
+# 2. COLOR HELPERS
+# ---------------------------------------------------------
+
+@lru_cache(maxsize=4096)
+def hex_to_rgb(hex_code):
+    hex_code = hex_code.lstrip('#')
+    return tuple(int(hex_code[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+
+
+def get_hsv(hex_code):
+    rgb = hex_to_rgb(hex_code)
+    return colorsys.rgb_to_hsv(rgb[0], rgb[1], rgb[2])
+
+
+def color_distance(hex1, hex2):
+    r1, g1, b1 = hex_to_rgb(hex1)
+    r2, g2, b2 = hex_to_rgb(hex2)
+    return math.sqrt((r1 - r2) ** 2 + (g1 - g2) ** 2 + (b1 - b2) ** 2)
+
+
+def srgb_to_oklab(rgb):
+    """
+    Converts an (..., 3) array of sRGB values in 0-1 to OKLab, where
+    Euclidean distance tracks perceived color difference.
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    lms = np.cbrt(linear @ _OKLAB_M1.T)
+    return lms @ _OKLAB_M2.T
+
+
+_OKLAB_M1 = np.array([
+    [0.4122214708, 0.5363325363, 0.0514459929],
+    [0.2119034982, 0.6806995451, 0.1073969566],
+    [0.0883024619, 0.2817188376, 0.6299787005],
+])
+_OKLAB_M2 = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660],
+])
+
+
+def hex_to_oklab(hex_code):
+    return tuple(srgb_to_oklab(hex_to_rgb(hex_code)).tolist())
+
+
+# Everything the sort and the renderers need about a commander's color,
+# computed once per color instead of once per frame.
+ColorInfo = namedtuple("ColorInfo", ["rgb", "hsv", "lab", "text_color"])
+
+
+@lru_cache(maxsize=4096)
+def color_info(hex_code):
+    rgb = hex_to_rgb(hex_code)
+    brightness = (rgb[0] * 299 + rgb[1] * 587 + rgb[2] * 114) / 1000
+    return ColorInfo(
+        rgb=rgb,
+        hsv=colorsys.rgb_to_hsv(*rgb),
+        lab=hex_to_oklab(hex_code),
+        text_color="black" if brightness > 0.6 else "white"
+    )
+
+
+def commander_color(p):
+    # Rosters built before colors were cached (e.g. in an old session) get it on the fly.
+    return p.get('color') or color_info(p['hex'])
+
+
+def generate_distinct_colors(existing_hexes, n, rng=random):
+    """
+    Picks n new colors, each as far as possible in OKLab from the existing
+    ones and from each other (greedy farthest-point sampling).
+
+    Candidates are a randomly jittered sRGB lattice with a few times more
+    points than colors needed. Lattice rows are compact in OKLab, so each
+    pick only re-scores the rows whose bounding box lies close enough to
+    change anything, and no retry loop is ever needed. rng is the random
+    module or a seeded RandomStream.
+    """
+    if n <= 0:
+        return []
+    levels = max(16, math.ceil((4 * (n + len(existing_hexes))) ** (1 / 3)))
+    jitter_rng = np.random.default_rng(rng.getrandbits(64))
+    steps = (np.arange(levels) + 0.5) / levels
+    lattice = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, levels, 3)
+    candidates = np.clip(lattice + jitter_rng.uniform(-0.5, 0.5, lattice.shape) / levels, 0.0, 1.0)
+    lab = srgb_to_oklab(candidates)
+    low = lab.min(axis=1)
+    high = lab.max(axis=1)
+
+    nearest = np.full(lab.shape[:2], np.inf)
+    if existing_hexes:
+        for h in existing_hexes:
+            d = lab - color_info(h).lab
+            np.minimum(nearest, np.einsum('ijk,ijk->ij', d, d), out=nearest)
+    row_best = nearest.max(axis=1)
+
+    picks = []
+    for _ in range(n):
+        row = int(np.argmax(row_best))
+        col = int(np.argmax(nearest[row]))
+        picks.append((row, col))
+        point = lab[row, col]
+        gap = np.maximum(low - point, 0.0) + np.maximum(point - high, 0.0)
+        rows = np.flatnonzero(np.einsum('ij,ij->i', gap, gap) < row_best)
+        d = lab[rows] - point
+        nearest[rows] = np.minimum(nearest[rows], np.einsum('ijk,ijk->ij', d, d))
+        row_best[rows] = nearest[rows].max(axis=1)
+
+    rgb = np.rint(np.array([candidates[r, c] for r, c in picks]) * 255).astype(int)
+    return ["#{:02x}{:02x}{:02x}".format(*c) for c in rgb.tolist()]
+
+
+def generate_distinct_color(existing_hexes, rng=random):
+    return generate_distinct_colors(existing_hexes, 1, rng)[0]
+
+
+def chunk_list(data, num_chunks):
+    k, m = divmod(len(data), num_chunks)
+    return [data[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(num_chunks)]
+
+
+def sort_players_perceptually(players):
+    def sort_key(player):
+        h, s, v = commander_color(player).hsv
+        is_grayscale = s < 0.15 or v < 0.15
+        if is_grayscale:
+            return (0, v, 0)
+        else:
+            return (1, h, v)
+
+    return sorted(players, key=sort_key)
+
+
+# ---------------------------------------------------------
+# 3. ROSTER
+# ---------------------------------------------------------
+
+def initialize_commanders(n, rng=random):
+    new_coms = []
+    limit = min(n, len(COMMON_COLORS))
+    for i in range(limit):
+        # Randomly assign faction from updated list (Armada, Cortex, Legion)
+        f = rng.choice(FACTIONS)
+        hex_c = COMMON_COLORS[i]
+        new_coms.append({"id": str(i + 1), "hex": hex_c, "faction": f, "color": color_info(hex_c)})
+
+    if n > limit:
+        new_hexes = generate_distinct_colors([p['hex'] for p in new_coms], n - limit, rng)
+        for i, new_hex in enumerate(new_hexes, start=limit):
+            f = rng.choice(FACTIONS)
+            new_coms.append({"id": str(i + 1), "hex": new_hex, "faction": f, "color": color_info(new_hex)})
+    return new_coms
+
+
+def roster_hash(players):
+    """
+    Stable digest of everything a lobby layout depends on (ids, colors and
+    factions in roster order), for keying caches across reruns.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for p in players:
+        digest.update(f"{p['id']}\x1f{p['hex']}\x1f{p['faction']}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+# ---------------------------------------------------------
+# 4. TEAM SPLIT
+# ---------------------------------------------------------
+
+SPLIT_METHODS = ["cohesive", "hue"]
+
+
+def team_sizes(n, num_teams):
+    """Sizes chunk_list produces: the first n % num_teams teams get one extra."""
+    k, m = divmod(n, num_teams)
+    return [k + 1 if i < m else k for i in range(num_teams)]
+
+
+def _members_matrix(assign, sizes):
+    """(num_teams, max size) matrix of point indices per team, padded with -1."""
+    members = np.full((len(sizes), max(sizes)), -1, dtype=np.int64)
+    order = np.argsort(assign, kind="stable")
+    start = 0
+    for t_idx, size in enumerate(sizes):
+        members[t_idx, :size] = order[start:start + size]
+        start += size
+    return members
+
+
+def _center_distances(lab, assign, num_teams):
+    counts = np.bincount(assign, minlength=num_teams)
+    centers = np.zeros((num_teams, 3))
+    np.add.at(centers, assign, lab)
+    centers /= np.maximum(counts, 1)[:, None]
+    return ((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+
+
+def _refine_by_swaps(lab, assign, sizes, max_iter=30):
+    """
+    Balanced k-means: alternates recentering with rounds of improving
+    swaps between teams, so sizes never change and the cost never rises.
+
+    For a pair of teams the best swap separates into the member of each team
+    that gains most by moving to the other, so every round prices all team
+    pairs at once from an (n, num_teams) distance matrix.
+    """
+    num_teams = len(sizes)
+    assign = assign.copy()
+    members = _members_matrix(assign, sizes)
+    valid = members >= 0
+    safe = np.where(valid, members, 0)
+    for _ in range(max_iter):
+        dist = _center_distances(lab, assign, num_teams)
+        swapped = False
+        while True:
+            own = dist[np.arange(len(assign)), assign]
+            # move[a, s, b]: cost change if member s of team a joined team b.
+            move = dist[safe] - own[safe][:, :, None]
+            move[~valid] = np.inf
+            pos = move.argmin(axis=1)
+            best = np.take_along_axis(move, pos[:, None, :], axis=1)[:, 0, :]
+            gain = best + best.T
+            np.fill_diagonal(gain, 0.0)
+            pairs = np.argwhere(np.triu(gain < -1e-12))
+            if len(pairs) == 0:
+                break
+            pairs = pairs[np.argsort(gain[pairs[:, 0], pairs[:, 1]], kind="stable")]
+            touched = set()
+            for a, b in pairs:
+                if a in touched or b in touched:
+                    continue
+                touched.update((a, b))
+                sa, sb = pos[a, b], pos[b, a]
+                i, j = members[a, sa], members[b, sb]
+                members[a, sa], members[b, sb] = j, i
+                safe[a, sa], safe[b, sb] = j, i
+                assign[i], assign[j] = b, a
+            swapped = True
+        if not swapped:
+            break
+    return assign
+
+
+def _lloyd_greedy(lab, assign, sizes, max_iter=10):
+    """
+    Cheap warm-up for _refine_by_swaps: recenter, then reassign greedily
+    under the size limits, until the assignment settles.
+    """
+    num_teams = len(sizes)
+    for _ in range(max_iter):
+        centers = np.zeros((num_teams, 3))
+        np.add.at(centers, assign, lab)
+        centers /= np.maximum(np.bincount(assign, minlength=num_teams), 1)[:, None]
+        new_assign = _greedy_assign(lab, centers, sizes)
+        if np.array_equal(new_assign, assign):
+            break
+        assign = new_assign
+    return assign
+
+
+def _greedy_assign(lab, centers, sizes):
+    """
+    Capacity-limited nearest-center assignment, placing the points with the
+    most to lose (largest gap to their second choice) first.
+    """
+    dist = ((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    first = dist.argmin(axis=1)
+    if dist.shape[1] > 1:
+        two = np.partition(dist, 1, axis=1)
+        regret = two[:, 1] - two[:, 0]
+    else:
+        regret = dist[:, 0]
+    left = list(sizes)
+    assign = np.empty(len(lab), dtype=np.int64)
+    for i in np.argsort(-regret, kind="stable").tolist():
+        t_idx = first[i]
+        if not left[t_idx]:
+            # Only points whose first choice is full need their full ranking.
+            t_idx = next(t for t in np.argsort(dist[i], kind="stable").tolist() if left[t])
+        left[t_idx] -= 1
+        assign[i] = t_idx
+    return assign
+
+
+def _plus_plus_centers(lab, num_teams, rng):
+    centers = [lab[rng.integers(len(lab))]]
+    closest = ((lab - centers[0]) ** 2).sum(axis=1)
+    for _ in range(num_teams - 1):
+        total = closest.sum()
+        pick = rng.choice(len(lab), p=closest / total) if total > 0 else rng.integers(len(lab))
+        centers.append(lab[pick])
+        closest = np.minimum(closest, ((lab - lab[pick]) ** 2).sum(axis=1))
+    return np.array(centers)
+
+
+def partition_teams(players, num_teams, method="cohesive", restarts=2, seed=0):
+    """
+    Splits players into num_teams teams of chunk_list's sizes.
+
+    "hue" is the original split: sort_players_perceptually, then chunk_list.
+    "cohesive" runs balanced k-means in OKLab from that split and from
+    `restarts` k-means++ starts and keeps the split with the lowest sum of
+    squared OKLab distances from each player to their team's mean color; the
+    hue split is returned instead if none beats it. Teams come back ordered
+    by where their members fall in the hue sort, members in hue order.
+    """
+    ordered = sort_players_perceptually(players)
+    fallback = chunk_list(ordered, num_teams)
+    if method == "hue" or num_teams < 2 or len(players) <= num_teams:
+        return fallback
+    if method != "cohesive":
+        raise ValueError(f"unknown split method {method!r}")
+
+    sizes = team_sizes(len(ordered), num_teams)
+    lab = np.array([commander_color(p).lab for p in ordered])
+    start = np.repeat(np.arange(num_teams), sizes)
+    rng = np.random.default_rng(seed)
+    starts = [start] + [_greedy_assign(lab, _plus_plus_centers(lab, num_teams, rng), sizes) for _ in range(restarts)]
+
+    best_assign = start
+    dist = _center_distances(lab, start, num_teams)
+    best_cost = float(dist[np.arange(len(start)), start].sum())
+    for assign in starts:
+        assign = _refine_by_swaps(lab, _lloyd_greedy(lab, assign, sizes), sizes)
+        dist = _center_distances(lab, assign, num_teams)
+        cost = float(dist[np.arange(len(assign)), assign].sum())
+        if cost < best_cost - 1e-12:
+            best_assign, best_cost = assign, cost
+    if best_assign is start:
+        return fallback
+
+    rank_sum = np.bincount(best_assign, weights=np.arange(len(ordered)), minlength=num_teams)
+    team_order = np.argsort(rank_sum / np.bincount(best_assign, minlength=num_teams), kind="stable")
+    return [[ordered[i] for i in np.flatnonzero(best_assign == t_idx)] for t_idx in team_order]
@@ -0,0 +1,355 @@
+"""
+HTML renderers for the lobby and battle views.
+
+Plain string builders with no Streamlit import, so they can be benchmarked
+and reused outside the app; app.py pushes their output with st.markdown.
+"""
+
+import base64
+import io
+import math
+
+import numpy as np
+
+from lobby import commander_color
+from simulation import DEATH_FLASH_TICKS, NO_TICK, SPAWN_FLASH_TICKS
+
+# ---------------------------------------------------------
+# 1. COMMANDER BOXES
+# ---------------------------------------------------------
+
+def color_class(hex_code):
+    return "c" + hex_code[1:].lower()
+
+
+def palette_css(players):
+    """
+    <style> block with one class per commander color (fill and contrasting
+    text), generated once per lobby for templates that use color classes.
+    """
+    rules = {}
+    for p in players:
+        rules.setdefault(color_class(p['hex']), f"background-color:{p['hex']};color:{commander_color(p).text_color}")
+    return "<style>" + "".join(f".{name}{{{rule}}}" for name, rule in rules.items()) + "</style>"
+
+
+def box_template(p, inline_colors=False):
+    """
+    The fixed parts of a commander box: (opening tag up to the event
+    classes, rest of the tag, label). Shape comes from the faction class;
+    color from the palette class, or an inline style when inline_colors.
+    """
+    pid = p['id']
+    faction = p['faction']
+    if inline_colors:
+        head = f"<div class='cmdr faction-{faction}"
+        style = f" style='background-color:{p['hex']};color:{commander_color(p).text_color}'"
+    else:
+        head = f"<div class='cmdr faction-{faction} {color_class(p['hex'])}"
+        style = ""
+    return head, f"'{style} title='{faction} Commander {pid}'>", f"<strong>{pid}</strong>"
+
+
+def dot_template(p, inline_colors=False):
+    """(opening tag up to the state classes, start of the style attribute) of a map dot."""
+    if inline_colors:
+        return f"<div class='unit-dot faction-{p['faction']}", f"' style='background:{p['hex']};left:"
+    return f"<div class='unit-dot faction-{p['faction']} {color_class(p['hex'])}", "' style='left:"
+
+
+class RenderTemplates:
+    """
+    Box and dot templates for every commander of a lobby, built once so a
+    frame only formats what changes (bars, event classes, position). With
+    color classes the page also needs css, which app.py injects once per
+    rerun; large lobbies use inline colors, where a class per commander
+    would outweigh what it saves.
+    """
+
+    def __init__(self, players, inline_colors=False):
+        self.boxes = {p['id']: box_template(p, inline_colors) for p in players}
+        self.dots = {p['id']: dot_template(p, inline_colors) for p in players}
+        self.css = "" if inline_colors else palette_css(players)
+
+
+EVENT_BOX_CLASSES = {"hit": " shake-box", "dgun": " attacker-box", "attack": " attacker-box"}
+
+
+def render_commander_box(p, hp, energy, is_alive, event_type=None, show_hud=True, template=None):
+    """
+    Renders a 'Commander' unit box.
+    """
+    head, tag_end, label = template or box_template(p, inline_colors=True)
+
+    # Animation Class
+    if is_alive:
+        extra_class = EVENT_BOX_CLASSES.get(event_type, "")
+    elif event_type == "die":
+        extra_class = " cmdr-dead blast-box"  # Comblast effect
+    else:
+        # If dead, show skull
+        extra_class = " cmdr-dead"
+        label = "💀"
+
+    # HUD (Bars)
+    hud_html = ""
+    if is_alive and show_hud:
+        # Both bars are drawn by .hud's pseudo-elements from these two widths.
+        hud_html = (
+            f"<div class='hud' style='--hp:{max(0, hp)}%;--en:{max(0, energy)}%' "
+            f"title='Structure: {hp}% · Energy: {energy}%'></div>"
+        )
+
+    return f"{head}{extra_class}{tag_end}{label}{hud_html}</div>"
+
+
+class FragmentCache:
+    """
+    Last rendered HTML per unit, keyed by the inputs it was built from, so a
+    frame only rebuilds the units whose position, stats or event changed.
+    served counts every fragment handed out and rebuilt the ones built anew.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.fragments = {}
+        self.rebuilt = 0
+        self.served = 0
+
+    def get(self, pid, key, build, *args):
+        self.served += 1
+        if self.keys.get(pid) != key:
+            self.keys[pid] = key
+            self.fragments[pid] = build(*args)
+            self.rebuilt += 1
+        return self.fragments[pid]
+
+# ---------------------------------------------------------
+# 2. BATTLE VIEWS
+# ---------------------------------------------------------
+
+def render_unit_dot(p, x, y, classes, template=None):
+    head, style = template or dot_template(p, inline_colors=True)
+    return f"{head}{classes}{style}{x:.1f}px;top:{y:.1f}px'></div>"
+
+
+def render_battle_map(players, state, event, cache=None, templates=None):
+    """
+    Renders the top-down RTS map for one tick of a BattleSimulator.
+    """
+    cache = cache or FragmentCache()
+    dots = templates.dots if templates else {}
+    tick = event.tick
+    hp, xs, ys = state.hp, state.x, state.y
+    spawn_ticks, death_ticks = state.spawn_tick, state.death_tick
+    parts = ["<div class='rts-map'>"]
+    for i, p in enumerate(players):
+        pid = p['id']
+        is_alive = hp[i] > 0
+        death_tick = death_ticks[i]
+        show_unit = is_alive or (death_tick != NO_TICK and (tick - death_tick) <= DEATH_FLASH_TICKS)
+        if not show_unit:
+            continue
+
+        classes = ""
+        if is_alive and (tick - spawn_ticks[i]) <= SPAWN_FLASH_TICKS:
+            classes += " unit-spawn"
+        if is_alive and pid == event.attacker:
+            classes += " unit-attacker"
+        if is_alive and pid == event.victim:
+            classes += " unit-hit"
+        if not is_alive:
+            classes += " unit-dead"
+
+        # Key on the rounded coordinates actually written to the page.
+        x = round(xs[i], 1)
+        y = round(ys[i], 1)
+        parts.append(cache.get(pid, (x, y, classes), render_unit_dot, p, x, y, classes, dots.get(pid)))
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def render_arena(teams, state, event, cache=None, templates=None):
+    """
+    Renders the per-team commander boxes for one tick of a BattleSimulator.
+    """
+    cache = cache or FragmentCache()
+    boxes = templates.boxes if templates else {}
+    parts = ["<div class='team-row'>"]
+    for t_idx, team in enumerate(teams):
+        card = "team-card" if state.team_alive[t_idx] > 0 else "team-card team-out"
+        parts.append(f"<div class='{card}'><div class='faction-label'>TEAM {t_idx + 1}</div><div class='team-units'>")
+
+        for p in team:
+            pid = p['id']
+            i = state.index[pid]
+            hp, en = state.hp[i], state.energy[i]
+            is_alive = hp > 0
+
+            evt = None
+            if is_alive and pid == event.attacker: evt = event.event_type if event.event_type == "dgun" else "attack"
+            if is_alive and pid == event.victim: evt = "hit"
+            if not is_alive and pid == event.victim and event.event_type == "die": evt = "die"
+
+            key = (hp, en, is_alive, evt)
+            parts.append(cache.get(pid, key, render_commander_box, p, hp, en, is_alive, evt, True, boxes.get(pid)))
+
+        parts.append("</div></div>")
+    parts.append("</div>")
+    return "".join(parts)
+
+
+class PlaceholderWriter:
+    """
+    Wraps an st.empty() slot and skips the websocket push when a frame's
+    HTML is identical to what the slot already shows.
+    """
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.html = None
+        self.bytes_sent = 0
+
+    def markdown(self, html):
+        if html != self.html:
+            self.html = html
+            self.bytes_sent += len(html.encode("utf-8"))
+            self.placeholder.markdown(html, unsafe_allow_html=True)
+
+    def empty(self):
+        if self.html is not None:
+            self.html = None
+            self.placeholder.empty()
+
+
+def render_profile_summary(summary):
+    """
+    Markdown table of a TickProfiler summary for the sidebar panel.
+    """
+    lines = [f"**Last {summary['ticks']} ticks**", "", "| Phase | mean ms | p95 ms |", "|---|---:|---:|"]
+    for name, stats in summary["phases"].items():
+        lines.append(f"| {name} | {stats['mean_ms']:.3f} | {stats['p95_ms']:.3f} |")
+    if summary["counters"]:
+        lines += ["", "| Counter | per tick |", "|---|---:|"]
+        for name, value in summary["counters"].items():
+            lines.append(f"| {name} | {value:,.0f} |")
+    return "\n".join(lines)
+
+# ---------------------------------------------------------
+# 3. LARGE BATTLE VIEWS
+# ---------------------------------------------------------
+# Past a few hundred units one DOM node per commander no longer scales, so
+# large battles draw each team as a density heatmap and show a bounded
+# sample of commander boxes.
+
+HEATMAP_COLUMNS = 160
+# Heatmap bins are sized for about this many units each at the start of a battle.
+HEATMAP_UNITS_PER_BIN = 4
+HEATMAP_BACKGROUND = (5, 5, 5)
+
+
+def team_colors(teams):
+    """(teams, 3) array of each team's mean commander color in 0-255."""
+    return np.array([
+        np.mean([commander_color(p).rgb for p in team], axis=0) if team else (0.5, 0.5, 0.5) for team in teams
+    ]) * 255
+
+
+def sample_evenly(items, k):
+    """At most k items spread evenly over the list, in list order."""
+    if len(items) <= k:
+        return list(items)
+    return [items[i * len(items) // k] for i in range(k)]
+
+
+def density_image(state, colors, width, height, columns=None):
+    """
+    (rows, columns, 3) uint8 heatmap of the living units: each bin takes the
+    color of the team with the most units in it, brighter the more units
+    there are (log scale).
+    """
+    if columns is None:
+        columns = math.sqrt(len(state.ids) * width / height / HEATMAP_UNITS_PER_BIN)
+        columns = int(min(HEATMAP_COLUMNS, max(16, columns)))
+    rows = max(1, round(columns * height / width))
+    alive = np.frombuffer(state.hp, dtype=np.int32) > 0
+    xs = np.frombuffer(state.x, dtype=np.float64)[alive]
+    ys = np.frombuffer(state.y, dtype=np.float64)[alive]
+    team = np.frombuffer(state.team, dtype=np.int32)[alive]
+    bx = np.clip((xs * columns / width).astype(np.int64), 0, columns - 1)
+    by = np.clip((ys * rows / height).astype(np.int64), 0, rows - 1)
+    bins = rows * columns
+    counts = np.bincount(team * bins + by * columns + bx, minlength=len(colors) * bins).reshape(len(colors), bins)
+    total = counts.sum(axis=0)
+    level = np.log1p(total) / np.log1p(max(1, total.max()))
+    background = np.array(HEATMAP_BACKGROUND, dtype=np.float64)
+    pixels = background + (colors[counts.argmax(axis=0)] - background) * level[:, None]
+    return pixels.reshape(rows, columns, 3).astype(np.uint8)
+
+
+def png_data_uri(pixels):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def render_density_map(state, event, colors, width, height):
+    """
+    Renders the RTS map as a team density heatmap, with markers for this
+    tick's attacker and target on top.
+    """
+    parts = [f"<div class='rts-map'><img class='density-map' src='{png_data_uri(density_image(state, colors, width, height))}'>"]
+    for pid, role in ((event.attacker, "unit-attacker"), (event.victim, "unit-hit")):
+        if pid is None:
+            continue
+        i = state.index[pid]
+        left = 100 * state.x[i] / width
+        top = 100 * state.y[i] / height
+        parts.append(f"<div class='unit-marker {role}' style='left:{left:.2f}%; top:{top:.2f}%;'></div>")
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def render_team_summary(teams, state, event, colors, sample, cache=None, templates=None):
+    """
+    Large-battle counterpart of render_arena: one card per team with its
+    survivor count and at most `sample` commander boxes (the first living
+    members, plus this tick's attacker and target when they are on the team).
+    """
+    cache = cache or FragmentCache()
+    boxes = templates.boxes if templates else {}
+    featured = {event.attacker, event.victim}
+    parts = ["<div class='team-row'>"]
+    for t_idx, team in enumerate(teams):
+        alive_count = state.team_alive[t_idx]
+        r, g, b = colors[t_idx].astype(int).tolist()
+        pct = 100 * alive_count / max(1, len(team))
+
+        parts.append(f"<div class='{'team-card' if alive_count else 'team-card team-out'}'>")
+        parts.append(f"<div class='faction-label'>TEAM {t_idx + 1} · {alive_count:,} / {len(team):,} ALIVE</div>")
+        parts.append(f"<div class='bar-container'><div class='hp-fill' style='width:{pct:.1f}%; background-color:rgb({r},{g},{b});'></div></div>")
+        parts.append("<div class='team-units'>")
+
+        shown = 0
+        for p in team:
+            pid = p['id']
+            i = state.index[pid]
+            hp, en = state.hp[i], state.energy[i]
+            is_alive = hp > 0
+            if pid not in featured and (not is_alive or shown >= sample):
+                continue
+            shown += 1
+
+            evt = None
+            if is_alive and pid == event.attacker: evt = event.event_type if event.event_type == "dgun" else "attack"
+            if is_alive and pid == event.victim: evt = "hit"
+            if not is_alive and pid == event.victim and event.event_type == "die": evt = "die"
+
+            key = (hp, en, is_alive, evt)
+            parts.append(cache.get(pid, key, render_commander_box, p, hp, en, is_alive, evt, True, boxes.get(pid)))
+
+        parts.append("</div></div>")
+    parts.append("</div>")
+    return "".join(parts)
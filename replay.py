@@ -0,0 +1,380 @@
+"""
+Compact binary battle replays.
+
+A ReplayWriter attached to a BattleSimulator records the roster, the seed of
+its SimContext and one small record per tick, plus a keyframe of quantized
+positions, HP and energy every K ticks. A Replay memory-maps the file and
+rebuilds any tick by starting from the nearest keyframe at or before it:
+
+    sim.recorder = ReplayWriter("battle.barreplay", sim)
+    sim.run_to_completion()
+    sim.recorder.close()
+
+    replay = Replay("battle.barreplay")
+    state, event, log = replay.frame(1234)
+
+HP, energy, events and logs are exact at every tick. Positions are exact (to
+the quantization step) at keyframes and linearly interpolated in between.
+
+File layout, all little-endian:
+    header   magic, version, keyframe interval, unit/team counts, map size, seed
+    roster   faction names, then id, hex, faction and team per unit, then the
+             unit order of every team
+    body     keyframe(0), ticks 1..K, keyframe(K), ticks K+1..2K, ...
+             a tick is a record count followed by that many records
+    footer   death ticks, a final keyframe, keyframe offsets, trailer
+"""
+
+import mmap
+import struct
+from array import array
+
+import numpy as np
+
+from lobby import color_info
+from simulation import (
+    LOG_LIMIT,
+    NO_TICK,
+    BattleLog,
+    BattleState,
+    LogEntry,
+    TickEvent,
+)
+
+# ---------------------------------------------------------
+# 1. FORMAT
+# ---------------------------------------------------------
+
+MAGIC = b"BARR"
+END_MAGIC = b"BARE"
+# Version 2 added comblast records; version 1 files read the same way.
+VERSION = 2
+DEFAULT_KEYFRAME_EVERY = 10
+
+HEADER = struct.Struct("<4sHIIHddBQ")
+TICK = struct.Struct("<H")
+RECORD = struct.Struct("<HHBH")
+RECORD_DTYPE = np.dtype([("att", "<u2"), ("vic", "<u2"), ("kind", "u1"), ("dmg", "<u2")])
+TRAILER = struct.Struct("<QIIhB4s")
+
+NO_UNIT = 0xFFFF
+NO_DEATH = 0xFFFFFFFF
+POS_MAX = 0xFFFF
+
+# Record kind: weapon in the low bits, flags above.
+WEAPON_NONE = 0
+WEAPON_LASER = 1
+WEAPON_DGUN = 2
+WEAPON_COMBLAST = 3
+KIND_KILL = 0x10
+KIND_GAME_OVER = 0x80
+
+WEAPON_CODES = {None: WEAPON_NONE, "Laser": WEAPON_LASER, "D-GUN": WEAPON_DGUN, "Comblast": WEAPON_COMBLAST}
+WEAPON_NAMES = {code: name for name, code in WEAPON_CODES.items()}
+
+
+def _pack_str(text):
+    data = text.encode("utf-8")
+    return struct.pack("<B", len(data)) + data
+
+
+def _unpack_str(buf, offset):
+    size = buf[offset]
+    return bytes(buf[offset + 1:offset + 1 + size]).decode("utf-8"), offset + 1 + size
+
+# ---------------------------------------------------------
+# 2. RECORDING
+# ---------------------------------------------------------
+
+class ReplayWriter:
+    """
+    Streams a battle to path as it is fought. Set it as sim.recorder before
+    the first step and close() it once the battle is over; keyframe_every
+    trades file size against how far positions are interpolated.
+    """
+
+    def __init__(self, path, sim, keyframe_every=DEFAULT_KEYFRAME_EVERY):
+        if sim.tick != 0:
+            raise ValueError("attach the recorder before the first tick")
+        if len(sim.players) >= NO_UNIT:
+            raise ValueError(f"replays hold at most {NO_UNIT - 1} units")
+
+        self.sim = sim
+        self.path = path
+        self.keyframe_every = keyframe_every
+        self.index = sim.state.index
+        self.scale_x = POS_MAX / sim.width
+        self.scale_y = POS_MAX / sim.height
+        self.keyframe_offsets = []
+        self.closed = False
+        self.handle = open(path, "wb")
+
+        state = sim.state
+        self.handle.write(HEADER.pack(
+            MAGIC, VERSION, keyframe_every, len(sim.players), len(sim.teams),
+            sim.width, sim.height, True, sim.ctx.seed,
+        ))
+
+        roster = [struct.pack("<B", len(state.faction_names))]
+        roster += [_pack_str(f) for f in state.faction_names]
+        for i, p in enumerate(sim.players):
+            roster.append(_pack_str(p['id']) + _pack_str(p['hex']))
+            roster.append(struct.pack("<BH", state.faction[i], state.team[i]))
+        for team in sim.teams:
+            order = array('H', (state.index[p['id']] for p in team))
+            roster.append(struct.pack("<I", len(order)) + order.tobytes())
+        self.handle.write(b"".join(roster))
+
+        self._write_keyframe()
+
+    def _write_keyframe(self):
+        self.keyframe_offsets.append(self.handle.tell())
+        self.handle.write(self._keyframe_bytes())
+
+    def _keyframe_bytes(self):
+        state = self.sim.state
+        xs = np.frombuffer(state.x, dtype=np.float64) * self.scale_x
+        ys = np.frombuffer(state.y, dtype=np.float64) * self.scale_y
+        hp = np.frombuffer(state.hp, dtype=np.int32)
+        energy = np.frombuffer(state.energy, dtype=np.int32)
+        return b"".join((
+            struct.pack("<I", self.sim.tick),
+            np.clip(np.rint(xs), 0, POS_MAX).astype("<u2").tobytes(),
+            np.clip(np.rint(ys), 0, POS_MAX).astype("<u2").tobytes(),
+            np.clip(hp, 0, 255).astype(np.uint8).tobytes(),
+            np.clip(energy, 0, 255).astype(np.uint8).tobytes(),
+        ))
+
+    def record(self, event):
+        if event.finished:
+            records = [(NO_UNIT, NO_UNIT, KIND_GAME_OVER, 0)]
+        elif self.sim.shots:
+            # One record per shot; simultaneous fire lands several in a tick.
+            records = [
+                (s.attacker, s.victim, WEAPON_CODES[s.weapon] | (KIND_KILL if s.killed else 0), min(s.damage, 0xFFFF))
+                for s in self.sim.shots
+            ]
+        else:
+            att = self.index[event.attacker] if event.attacker is not None else NO_UNIT
+            records = [(att, NO_UNIT, WEAPON_NONE, 0)]
+        self.handle.write(TICK.pack(len(records)) + b"".join(RECORD.pack(*r) for r in records))
+
+        if event.tick % self.keyframe_every == 0 and not event.finished:
+            self._write_keyframe()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        sim = self.sim
+        footer_offset = self.handle.tell()
+        death = np.frombuffer(sim.state.death_tick, dtype=np.int32)
+        death = np.where(death == NO_TICK, NO_DEATH, death).astype("<u4")
+        offsets = np.asarray(self.keyframe_offsets, dtype="<u8")
+        winner = sim.winner if sim.winner is not None else -1
+        self.handle.write(death.tobytes())
+        self.handle.write(self._keyframe_bytes())
+        self.handle.write(offsets.tobytes())
+        self.handle.write(TRAILER.pack(footer_offset, sim.tick, len(offsets), winner, sim.finished, END_MAGIC))
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ---------------------------------------------------------
+# 3. PLAYBACK
+# ---------------------------------------------------------
+
+class Replay:
+    """
+    Memory-mapped view of a replay file. players and teams are rebuilt in
+    the same shape the app uses, so the usual renderers can draw frame(t).
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as handle:
+            self.mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self.mm
+
+        (magic, version, self.keyframe_every, n, num_teams,
+         self.width, self.height, has_seed, seed) = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError("not a battle replay")
+        if not 1 <= version <= VERSION:
+            raise ValueError(f"unsupported replay version {version}")
+        self.seed = seed if has_seed else None
+        self.n = n
+
+        offset = HEADER.size
+        faction_count = buf[offset]
+        offset += 1
+        faction_names = []
+        for _ in range(faction_count):
+            name, offset = _unpack_str(buf, offset)
+            faction_names.append(name)
+
+        self.players = []
+        team_of = []
+        for _ in range(n):
+            pid, offset = _unpack_str(buf, offset)
+            hex_c, offset = _unpack_str(buf, offset)
+            faction, team = struct.unpack_from("<BH", buf, offset)
+            offset += 3
+            self.players.append({"id": pid, "hex": hex_c, "faction": faction_names[faction], "color": color_info(hex_c)})
+            team_of.append(team)
+        self.hex_of = [p['hex'] for p in self.players]
+
+        self.teams = []
+        for _ in range(num_teams):
+            (size,) = struct.unpack_from("<I", buf, offset)
+            offset += 4
+            order = np.frombuffer(buf, dtype="<u2", count=size, offset=offset)
+            self.teams.append([self.players[i] for i in order])
+            offset += 2 * size
+
+        footer_offset, self.ticks, keyframe_count, winner, finished, end_magic = TRAILER.unpack_from(buf, len(buf) - TRAILER.size)
+        if end_magic != END_MAGIC:
+            raise ValueError("replay is truncated; the writer was not closed")
+        self.finished = bool(finished)
+        self.winner = winner if self.finished else None
+
+        self.keyframe_size = 4 + 6 * n
+        self.death_tick = np.frombuffer(buf, dtype="<u4", count=n, offset=footer_offset).astype(np.int64)
+        self.death_tick[self.death_tick == NO_DEATH] = NO_TICK
+        self.final_keyframe = footer_offset + 4 * n
+        self.keyframe_offsets = np.frombuffer(
+            buf, dtype="<u8", count=keyframe_count, offset=self.final_keyframe + self.keyframe_size
+        ).copy()
+
+    def close(self):
+        self.mm.close()
+
+    def _keyframe(self, offset):
+        n = self.n
+        (tick,) = struct.unpack_from("<I", self.mm, offset)
+        offset += 4
+        xs = np.frombuffer(self.mm, dtype="<u2", count=n, offset=offset) / POS_MAX * self.width
+        ys = np.frombuffer(self.mm, dtype="<u2", count=n, offset=offset + 2 * n) / POS_MAX * self.height
+        hp = np.frombuffer(self.mm, dtype=np.uint8, count=n, offset=offset + 4 * n)
+        energy = np.frombuffer(self.mm, dtype=np.uint8, count=n, offset=offset + 5 * n)
+        return tick, xs, ys, hp, energy
+
+    def _keyframe_index(self, tick):
+        return min(tick // self.keyframe_every, len(self.keyframe_offsets) - 1)
+
+    def _ticks_after(self, k, last_tick):
+        """
+        Yields (tick, records) for the ticks following keyframe k, up to and
+        including last_tick; records is a RECORD_DTYPE array.
+        """
+        offset = int(self.keyframe_offsets[k]) + self.keyframe_size
+        tick = k * self.keyframe_every
+        while tick < last_tick:
+            tick += 1
+            (count,) = TICK.unpack_from(self.mm, offset)
+            offset += TICK.size
+            records = np.frombuffer(self.mm, dtype=RECORD_DTYPE, count=count, offset=offset)
+            offset += count * RECORD.size
+            yield tick, records
+
+    def _check_tick(self, tick):
+        if not 0 <= tick <= self.ticks:
+            raise IndexError(f"tick {tick} is outside 0..{self.ticks}")
+
+    def state_at(self, tick):
+        """
+        Returns a BattleState for the end of the given tick.
+        """
+        self._check_tick(tick)
+        k = self._keyframe_index(tick)
+        t0, x0, y0, hp, energy = self._keyframe(int(self.keyframe_offsets[k]))
+        hp = hp.astype(np.int64)
+        energy = energy.astype(np.int64)
+        for _, records in self._ticks_after(k, tick):
+            kind = records["kind"]
+            if kind[0] & KIND_GAME_OVER:
+                continue
+            alive = hp > 0
+            energy[alive] = np.minimum(100, energy[alive] + 5)
+            weapon = kind & 0x0F
+            fired = weapon != WEAPON_NONE
+            att = records["att"][fired].astype(np.int64)
+            vic = records["vic"][fired].astype(np.int64)
+            kind = kind[fired]
+            weapon = weapon[fired]
+            # Every unit fires at most once a tick; a victim can be hit several times. The extra
+            # records of a D-GUN line repeat its attacker, and comblasts cost no energy.
+            shot = weapon != WEAPON_COMBLAST
+            energy[att[shot]] = np.where(weapon[shot] == WEAPON_DGUN, 0, np.maximum(0, energy[att[shot]] - 10))
+            np.subtract.at(hp, vic, records["dmg"][fired].astype(np.int64))
+            hp[vic[(kind & KIND_KILL) != 0]] = 0
+
+        if k + 1 < len(self.keyframe_offsets):
+            t1, x1, y1, _, _ = self._keyframe(int(self.keyframe_offsets[k + 1]))
+        else:
+            t1, x1, y1, _, _ = self._keyframe(self.final_keyframe)
+        frac = (tick - t0) / (t1 - t0) if t1 > t0 else 0.0
+        xs = (x0 + (x1 - x0) * frac).tolist()
+        ys = (y0 + (y1 - y0) * frac).tolist()
+
+        positions = {p['id']: {'x': x, 'y': y} for p, x, y in zip(self.players, xs, ys)}
+        state = BattleState(self.players, self.teams, positions)
+        state.hp = array('i', hp.tolist())
+        state.energy = array('i', energy.tolist())
+        state.death_tick = array('i', np.where(self.death_tick <= tick, self.death_tick, NO_TICK).tolist())
+        state.recount_alive()
+        return state
+
+    def _to_event(self, tick, record):
+        att, vic, kind, dmg = record
+        if kind & KIND_GAME_OVER:
+            entry = LogEntry(tick, None, self.winner, None, 0, False)
+            return TickEvent(tick, None, None, None, None, 0, entry, True, self.winner)
+        att_id = self.players[att]['id'] if att != NO_UNIT else None
+        weapon = kind & 0x0F
+        if weapon == WEAPON_NONE:
+            return TickEvent(tick, att_id, None, None, None, 0, None, False, None)
+        wpn_name = WEAPON_NAMES[weapon]
+        vic_id = self.players[vic]['id']
+        killed = bool(kind & KIND_KILL)
+        event_type = "die" if killed else ("dgun" if weapon == WEAPON_DGUN else "attack")
+        entry = LogEntry(tick, att, vic, wpn_name, dmg, killed)
+        return TickEvent(tick, att_id, vic_id, event_type, wpn_name, dmg, entry, False, None)
+
+    def event_at(self, tick):
+        self._check_tick(tick)
+        if tick == 0:
+            return TickEvent(0, None, None, None, None, 0, None, False, None)
+        k = self._keyframe_index(tick - 1)
+        for t, records in self._ticks_after(k, tick):
+            if t == tick:
+                return self._to_event(tick, records[0].tolist())
+
+    def logs_at(self, tick, limit=LOG_LIMIT):
+        """
+        Returns the simulator's BattleLog as it stood after the given tick,
+        walking back one keyframe block at a time.
+        """
+        self._check_tick(tick)
+        entries = []
+        k = self._keyframe_index(max(0, tick - 1))
+        while k >= 0 and len(entries) < limit:
+            block = []
+            last = min(tick, (k + 1) * self.keyframe_every)
+            for t, records in self._ticks_after(k, last):
+                for record in records.tolist():
+                    entry = self._to_event(t, record).log
+                    if entry is not None:
+                        block.append(entry)
+            entries = block + entries
+            k -= 1
+        log = BattleLog([p['id'] for p in self.players], self.hex_of, limit)
+        for entry in entries[-limit:]:
+            log.append(entry)
+        return log
+
+    def frame(self, tick):
+        return self.state_at(tick), self.event_at(tick), self.logs_at(tick)
@@ -0,0 +1,48 @@
+"""
+Seeded random number streams for reproducible battles.
+
+A SimContext turns one integer seed into an independent stream per
+subsystem, so drawing more numbers in one place (say, a larger lobby) does
+not shift what another subsystem sees:
+
+    ctx = SimContext(seed=42)
+    players = initialize_commanders(32, rng=ctx.lobby)
+    sim = BattleSimulator(players, teams, ctx=ctx)
+
+Streams are derived with NumPy's SeedSequence, so the same seed gives the
+same battle in any process or on any machine.
+"""
+
+import random
+
+import numpy as np
+
+STREAMS = ("lobby", "spawn", "movement", "combat")
+
+
+class RandomStream(random.Random):
+    """
+    A random.Random for scalar draws (choice, uniform, randint, ...) with a
+    NumPy Generator on np for drawing large batches in one call. Both are
+    seeded from the same SeedSequence.
+    """
+
+    def __init__(self, seed_seq):
+        super().__init__(int.from_bytes(seed_seq.generate_state(4).tobytes(), "little"))
+        self.np = np.random.default_rng(seed_seq)
+
+
+class SimContext:
+    """
+    One RandomStream per subsystem, all derived from seed. A seed of None
+    draws a fresh one from the OS; it is kept on seed either way so the
+    battle can be replayed.
+    """
+
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(63)
+        self.seed = seed
+        children = np.random.SeedSequence(seed).spawn(len(STREAMS))
+        for name, child in zip(STREAMS, children):
+            setattr(self, name, RandomStream(child))
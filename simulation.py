@@ -0,0 +1,1299 @@
+"""
+Headless battle engine for the BAR Commander Simulator.
+
+Nothing in here imports Streamlit, so battles can run in scripts, batch jobs
+and benchmarks as well as behind the UI in app.py.
+"""
+
+import math
+import random
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque, namedtuple
+
+import numpy as np
+
+from rng import SimContext
+
+# ---------------------------------------------------------
+# 1. CONSTANTS
+# ---------------------------------------------------------
+
+MAP_WIDTH = 640
+MAP_HEIGHT = 360
+FIRE_RANGE = 90
+MIN_SEPARATION = 18
+SEPARATION_FORCE = 2.4
+HARD_MIN_SEPARATION = 18
+SPAWN_FLASH_TICKS = 2
+DEATH_FLASH_TICKS = 2
+LOG_LIMIT = 50
+NO_TICK = -1
+# "grid" moves units one after another exactly as step_positions does;
+# "array" moves them all at once with ArrayMovementEngine, for large battles.
+MOVEMENT_MODES = ["grid", "array"]
+# "single" has one random commander fire per tick; in "simultaneous" every
+# commander within FIRE_RANGE of its nearest enemy fires in the same tick.
+COMBAT_MODES = ["single", "simultaneous"]
+DGUN_CHANCE = 0.3
+DGUN_DAMAGE = 9999
+LASER_DAMAGE = (10, 25)
+# With area_effects, a commander's death explosion (comblast) hits every unit
+# within COMBLAST_RADIUS for up to COMBLAST_DAMAGE, falling off linearly with
+# distance, and a D-GUN shot hits every unit within DGUN_WIDTH of its line of
+# fire out to FIRE_RANGE. Comblasts that kill set off further comblasts.
+COMBLAST_RADIUS = 40
+COMBLAST_DAMAGE = 60
+DGUN_WIDTH = 6
+
+
+def map_size(unit_count):
+    """
+    Map dimensions that keep the unit density of a 100-commander battle on
+    the default map, so 10,000 units are not one pile of overlapping dots.
+    """
+    scale = math.sqrt(max(1.0, unit_count / 100))
+    return MAP_WIDTH * scale, MAP_HEIGHT * scale
+
+# ---------------------------------------------------------
+# 2. MOVEMENT
+# ---------------------------------------------------------
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def initialize_positions(teams, width, height, margin=18, rng=random):
+    positions = {}
+    if not teams:
+        return positions
+
+    band_width = width / max(1, len(teams))
+    for t_idx, team in enumerate(teams):
+        x_min = t_idx * band_width + margin
+        x_max = (t_idx + 1) * band_width - margin
+        if x_max <= x_min:
+            x_min = margin
+            x_max = width - margin
+        for p in team:
+            positions[p['id']] = {
+                'x': rng.uniform(x_min, x_max),
+                'y': rng.uniform(margin, height - margin)
+            }
+    return positions
+
+
+class SpatialGrid:
+    """
+    Uniform grid over unit positions. Cells hold unit ids in alive order so
+    queries break distance ties the same way a linear scan over alive_ids does.
+    Every cell also keeps one bucket per team, and every team its bounding
+    box of cells, so nearest_enemy only ever reads enemy buckets and skips
+    the rings between a unit and the nearest enemy team.
+
+    Coordinates are read from the xs/ys mappings given to rebuild() (dicts
+    keyed by id, or arrays indexed by dense id), so the grid always sees
+    their current values; call move() after changing a unit's coordinates.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.xs = {}
+        self.ys = {}
+        self.cells = {}
+        self.team_cells = {}
+        self.team_bounds = {}
+        self.enemy_bounds = {}
+        self.cell_of = {}
+        self.team_of = {}
+        self.rank = {}
+        self.bounds = (0, 0, 0, 0)
+        # Candidates looked at by queries since the last rebuild, for profiling.
+        self.checks = 0
+
+    def _cell(self, pid):
+        return int(self.xs[pid] // self.cell_size), int(self.ys[pid] // self.cell_size)
+
+    def _grow_bounds(self, cell, team):
+        cx, cy = cell
+        min_x, min_y, max_x, max_y = self.bounds
+        self.bounds = (min(min_x, cx), min(min_y, cy), max(max_x, cx), max(max_y, cy))
+        bounds = self.team_bounds.get(team)
+        if bounds is None:
+            grown = (cx, cy, cx, cy)
+        else:
+            min_x, min_y, max_x, max_y = bounds
+            grown = (min(min_x, cx), min(min_y, cy), max(max_x, cx), max(max_y, cy))
+        if grown != bounds:
+            self.team_bounds[team] = grown
+            self.enemy_bounds = {}
+
+    def _enemy_bounds(self, team):
+        """Box of cells around every team but team, or None when there is no other team."""
+        if team not in self.enemy_bounds:
+            boxes = [b for t, b in self.team_bounds.items() if t != team]
+            self.enemy_bounds[team] = (
+                min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+            ) if boxes else None
+        return self.enemy_bounds[team]
+
+    def _insert(self, bucket, pid):
+        # Keep alive order inside the bucket so ties resolve like the linear scan.
+        rank = self.rank[pid]
+        i = len(bucket)
+        while i > 0 and self.rank[bucket[i - 1]] > rank:
+            i -= 1
+        bucket.insert(i, pid)
+
+    def rebuild(self, alive_ids, team_of, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        self.cells = {}
+        self.team_cells = {}
+        self.team_bounds = {}
+        self.enemy_bounds = {}
+        self.cell_of = {}
+        self.team_of = {}
+        self.rank = {}
+        self.checks = 0
+        for idx, pid in enumerate(alive_ids):
+            cell = self._cell(pid)
+            team = team_of[pid]
+            self.cells.setdefault(cell, []).append(pid)
+            self.team_cells.setdefault(cell, {}).setdefault(team, []).append(pid)
+            self.cell_of[pid] = cell
+            self.team_of[pid] = team
+            self.rank[pid] = idx
+        # Bounds are grown once per occupied cell rather than once per unit.
+        self.bounds = next(iter(self.cells), (0, 0)) * 2
+        for cell, teams_here in self.team_cells.items():
+            for team in teams_here:
+                self._grow_bounds(cell, team)
+        return self
+
+    def move(self, pid):
+        """Re-buckets pid after its coordinates changed."""
+        old = self.cell_of.get(pid)
+        if old is None:
+            return
+        new = self._cell(pid)
+        if new == old:
+            return
+        team = self.team_of[pid]
+        bucket = self.cells[old]
+        bucket.remove(pid)
+        if not bucket:
+            del self.cells[old]
+        self._insert(self.cells.setdefault(new, []), pid)
+        teams_here = self.team_cells[old]
+        bucket = teams_here[team]
+        bucket.remove(pid)
+        if not bucket:
+            del teams_here[team]
+            if not teams_here:
+                del self.team_cells[old]
+        self._insert(self.team_cells.setdefault(new, {}).setdefault(team, []), pid)
+        self.cell_of[pid] = new
+        self._grow_bounds(new, team)
+
+    def _ring(self, cx, cy, r, bounds):
+        """Cells r rings out from (cx, cy) that lie inside bounds."""
+        min_x, min_y, max_x, max_y = bounds
+        if r == 0:
+            if min_x <= cx <= max_x and min_y <= cy <= max_y:
+                yield cx, cy
+            return
+        x_lo = max(cx - r, min_x)
+        x_hi = min(cx + r, max_x)
+        for y in (cy - r, cy + r):
+            if min_y <= y <= max_y:
+                for x in range(x_lo, x_hi + 1):
+                    yield x, y
+        y_lo = max(cy - r + 1, min_y)
+        y_hi = min(cy + r - 1, max_y)
+        for x in (cx - r, cx + r):
+            if min_x <= x <= max_x:
+                for y in range(y_lo, y_hi + 1):
+                    yield x, y
+
+    def nearest_enemy(self, pid):
+        team = self.team_of[pid]
+        cx, cy = self._cell(pid)
+        bounds = self._enemy_bounds(team)
+        if bounds is None:
+            return None
+        # Only cells inside the enemies' box can hold a target, so rings that do not reach it are skipped.
+        min_x, min_y, max_x, max_y = bounds
+        first = max(0, min_x - cx, cx - max_x, min_y - cy, cy - max_y)
+        last = max(cx - min_x, max_x - cx, cy - min_y, max_y - cy)
+
+        xs = self.xs
+        ys = self.ys
+        rank = self.rank
+        px = xs[pid]
+        py = ys[pid]
+        best_id = None
+        best_dist = None
+        best_rank = None
+        for r in range(first, last + 1):
+            # Every cell on ring r is at least r - 1 cells away from the query point.
+            reach = (r - 1) * self.cell_size
+            if best_dist is not None and r > 0 and best_dist < reach * reach:
+                break
+            for cell in self._ring(cx, cy, r, bounds):
+                teams_here = self.team_cells.get(cell)
+                if not teams_here:
+                    continue
+                for other_team, bucket in teams_here.items():
+                    if other_team == team:
+                        continue
+                    self.checks += len(bucket)
+                    for other_id in bucket:
+                        dx = xs[other_id] - px
+                        dy = ys[other_id] - py
+                        dist = dx * dx + dy * dy
+                        if best_dist is None or dist < best_dist or (
+                            dist == best_dist and rank[other_id] < best_rank
+                        ):
+                            best_dist = dist
+                            best_id = other_id
+                            best_rank = rank[other_id]
+        return best_id
+
+    def neighbors(self, pid, min_rank=-1):
+        """Ids in the 3x3 block of cells around pid with rank above min_rank, in alive order."""
+        cx, cy = self._cell(pid)
+        found = []
+        for x in range(cx - 1, cx + 2):
+            for y in range(cy - 1, cy + 2):
+                bucket = self.cells.get((x, y))
+                if not bucket:
+                    continue
+                for other_id in bucket:
+                    if other_id != pid and self.rank[other_id] > min_rank:
+                        found.append(other_id)
+        self.checks += len(found)
+        found.sort(key=self.rank.__getitem__)
+        return found
+
+    def _cells_over(self, x0, y0, x1, y1):
+        """Cell coordinates covering the box from (x0, y0) to (x1, y1)."""
+        size = self.cell_size
+        min_x, min_y, max_x, max_y = self.bounds
+        for cx in range(max(min_x, int(x0 // size)), min(max_x, int(x1 // size)) + 1):
+            for cy in range(max(min_y, int(y0 // size)), min(max_y, int(y1 // size)) + 1):
+                yield cx, cy
+
+    def within(self, x, y, radius):
+        """Ids within radius of (x, y), in alive order."""
+        xs = self.xs
+        ys = self.ys
+        found = []
+        for cell in self._cells_over(x - radius, y - radius, x + radius, y + radius):
+            bucket = self.cells.get(cell)
+            if not bucket:
+                continue
+            self.checks += len(bucket)
+            for other_id in bucket:
+                dx = xs[other_id] - x
+                dy = ys[other_id] - y
+                if dx * dx + dy * dy <= radius * radius:
+                    found.append(other_id)
+        found.sort(key=self.rank.__getitem__)
+        return found
+
+    def along(self, x0, y0, x1, y1, width):
+        """Ids within width of the segment from (x0, y0) to (x1, y1), in alive order."""
+        xs = self.xs
+        ys = self.ys
+        sx = x1 - x0
+        sy = y1 - y0
+        length2 = sx * sx + sy * sy
+        found = []
+        cells = self._cells_over(min(x0, x1) - width, min(y0, y1) - width, max(x0, x1) + width, max(y0, y1) + width)
+        for cell in cells:
+            bucket = self.cells.get(cell)
+            if not bucket:
+                continue
+            self.checks += len(bucket)
+            for other_id in bucket:
+                px = xs[other_id] - x0
+                py = ys[other_id] - y0
+                t = clamp((px * sx + py * sy) / length2, 0.0, 1.0) if length2 else 0.0
+                dx = px - t * sx
+                dy = py - t * sy
+                if dx * dx + dy * dy <= width * width:
+                    found.append(other_id)
+        found.sort(key=self.rank.__getitem__)
+        return found
+
+
+def enemy_grid_cell_size(unit_count, width, height):
+    # Aim for roughly one unit per cell; never finer than the separation radius.
+    return max(MIN_SEPARATION, math.sqrt(width * height / max(1, unit_count)))
+
+
+def get_closest_enemy(pid, alive_ids, p_team_map, positions, grid=None):
+    # A grid answers from the coordinates it was last rebuilt over.
+    if grid is not None:
+        return grid.nearest_enemy(pid)
+    best_id = None
+    best_dist = None
+    for other_id in alive_ids:
+        if p_team_map[other_id] == p_team_map[pid]:
+            continue
+        dx = positions[other_id]['x'] - positions[pid]['x']
+        dy = positions[other_id]['y'] - positions[pid]['y']
+        dist = dx * dx + dy * dy
+        if best_dist is None or dist < best_dist:
+            best_dist = dist
+            best_id = other_id
+    return best_id
+
+
+def step_positions(
+    alive_ids,
+    p_team_map,
+    positions,
+    width,
+    height,
+    speed=3.2,
+    jitter=0.6,
+    margin=10,
+    min_sep=MIN_SEPARATION,
+    sep_force=SEPARATION_FORCE,
+    hard_min=HARD_MIN_SEPARATION,
+    grid=None
+):
+    xs = {pid: positions[pid]['x'] for pid in alive_ids}
+    ys = {pid: positions[pid]['y'] for pid in alive_ids}
+    move_units(alive_ids, p_team_map, xs, ys, width, height, speed, jitter, margin, min_sep, sep_force, hard_min, grid)
+    for pid in alive_ids:
+        positions[pid]['x'] = xs[pid]
+        positions[pid]['y'] = ys[pid]
+
+
+def move_units(
+    alive_ids,
+    team_of,
+    xs,
+    ys,
+    width,
+    height,
+    speed=3.2,
+    jitter=0.6,
+    margin=10,
+    min_sep=MIN_SEPARATION,
+    sep_force=SEPARATION_FORCE,
+    hard_min=HARD_MIN_SEPARATION,
+    grid=None,
+    rng=None
+):
+    """
+    One movement tick over coordinate columns: xs/ys and team_of are indexed
+    by unit id (dicts keyed by commander id or arrays indexed by dense id).
+    step_positions is the same tick over the dict-of-dicts positions.
+
+    With a RandomStream as rng, the whole tick's jitter is drawn in one batch;
+    without one, the global random module is used a unit at a time.
+    """
+    if grid is None:
+        grid = SpatialGrid(enemy_grid_cell_size(len(alive_ids), width, height))
+    grid.rebuild(alive_ids, team_of, xs, ys)
+    # Separation only reaches min_sep/hard_min, so a cell that size bounds it to the 3x3 block.
+    sep_grid = SpatialGrid(max(min_sep, hard_min, 1)).rebuild(alive_ids, team_of, xs, ys)
+    noise = rng.np.uniform(-jitter, jitter, (len(alive_ids), 2)).tolist() if rng is not None else None
+    rng = rng or random
+
+    for k, pid in enumerate(alive_ids):
+        target_id = grid.nearest_enemy(pid)
+        if target_id is None:
+            continue
+        dx = xs[target_id] - xs[pid]
+        dy = ys[target_id] - ys[pid]
+        dist = math.hypot(dx, dy)
+        if dist == 0:
+            continue
+        nx = dx / dist
+        ny = dy / dist
+
+        repulse_x = 0.0
+        repulse_y = 0.0
+        if min_sep > 0:
+            for other_id in sep_grid.neighbors(pid):
+                ox = xs[pid] - xs[other_id]
+                oy = ys[pid] - ys[other_id]
+                o_dist = math.hypot(ox, oy)
+                if 0 < o_dist < min_sep:
+                    scale = (min_sep - o_dist) / min_sep
+                    repulse_x += (ox / o_dist) * scale
+                    repulse_y += (oy / o_dist) * scale
+
+        if noise is None:
+            jitter_x = random.uniform(-jitter, jitter)
+            jitter_y = random.uniform(-jitter, jitter)
+        else:
+            jitter_x, jitter_y = noise[k]
+        xs[pid] = clamp(
+            xs[pid] + nx * speed + repulse_x * sep_force + jitter_x,
+            margin,
+            width - margin
+        )
+        ys[pid] = clamp(
+            ys[pid] + ny * speed + repulse_y * sep_force + jitter_y,
+            margin,
+            height - margin
+        )
+
+        if hard_min > 0:
+            candidates = sep_grid.neighbors(pid)
+            i = 0
+            while i < len(candidates):
+                other_id = candidates[i]
+                i += 1
+                ox = xs[pid] - xs[other_id]
+                oy = ys[pid] - ys[other_id]
+                o_dist = math.hypot(ox, oy)
+                if o_dist == 0:
+                    ox = rng.uniform(-1.0, 1.0)
+                    oy = rng.uniform(-1.0, 1.0)
+                    o_dist = math.hypot(ox, oy)
+                if o_dist < hard_min:
+                    push = (hard_min - o_dist) / o_dist
+                    xs[pid] = clamp(xs[pid] + ox * push, margin, width - margin)
+                    ys[pid] = clamp(ys[pid] + oy * push, margin, height - margin)
+                    # The push moved pid, so re-query around its new spot for the units still to check.
+                    candidates = sep_grid.neighbors(pid, sep_grid.rank[other_id])
+                    i = 0
+
+        grid.move(pid)
+        sep_grid.move(pid)
+    grid.checks += sep_grid.checks
+    return grid
+
+
+class ArrayMovementEngine:
+    """
+    Batched NumPy counterpart of step_positions for large lobbies.
+
+    Positions, team ids and the alive mask live in contiguous arrays indexed
+    by a dense unit index. Every unit moves from the same snapshot of the
+    previous tick, where step_positions moves units one after another, so the
+    two drift apart once units start interacting. Pass a seed, or a
+    Generator such as SimContext.movement.np, to get reproducible
+    trajectories.
+
+    sequential=True is the reference mode: each step runs move_units over the
+    engine's columns, one unit after another and drawing jitter from the
+    random module, so after the same random.seed() it reproduces
+    step_positions exactly. It is as slow as step_positions and is meant for
+    checking the batched step against it, not for large lobbies.
+    """
+
+    def __init__(
+        self,
+        ids,
+        teams,
+        xy,
+        width,
+        height,
+        seed=None,
+        speed=3.2,
+        jitter=0.6,
+        margin=10,
+        min_sep=MIN_SEPARATION,
+        sep_force=SEPARATION_FORCE,
+        hard_min=HARD_MIN_SEPARATION,
+        sequential=False
+    ):
+        self.ids = list(ids)
+        self.index = {pid: i for i, pid in enumerate(self.ids)}
+        self.team = np.ascontiguousarray(teams, dtype=np.int32)
+        self.xy = np.ascontiguousarray(xy, dtype=np.float64).reshape(len(self.ids), 2)
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.width = width
+        self.height = height
+        self.speed = speed
+        self.jitter = jitter
+        self.margin = margin
+        self.min_sep = min_sep
+        self.sep_force = sep_force
+        self.hard_min = hard_min
+        self.sequential = sequential
+        self.rng = np.random.default_rng(seed)
+        # Sorted positions for within()/along(), built on first use after each step.
+        self.query_index = None
+        # Distances the last nearest_enemy() computed, for the profiler's distance_checks.
+        self.checks = 0
+
+    @classmethod
+    def from_positions(cls, alive_ids, p_team_map, positions, width, height, **kwargs):
+        xy = [(positions[pid]['x'], positions[pid]['y']) for pid in alive_ids]
+        teams = [p_team_map[pid] for pid in alive_ids]
+        return cls(alive_ids, teams, xy, width, height, **kwargs)
+
+    def to_positions(self, positions=None):
+        if positions is None:
+            positions = {}
+        for pid, (x, y) in zip(self.ids, self.xy.tolist()):
+            positions[pid] = {'x': x, 'y': y}
+        return positions
+
+    def kill(self, pid):
+        self.alive[self.index[pid]] = False
+
+    def _close_pairs(self, xy, radius):
+        """
+        Every unordered pair (i, j) of rows of xy closer than radius, once,
+        with the offset xy[i] - xy[j] and its length.
+        """
+        # Sort points by cell and scan half of the 3x3 stencil; the other half is the same pairs reversed.
+        cells = np.floor(xy / radius).astype(np.int64) + 1
+        stride = int(math.ceil(self.height / radius)) + 3
+        keys = cells[:, 0] * stride + cells[:, 1]
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        sx = xy[order, 0]
+        sy = xy[order, 1]
+        here = np.arange(keys.size)
+        found_i = []
+        found_j = []
+        for dx, dy in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+            probe = keys + dx * stride + dy
+            start = np.searchsorted(keys, probe, 'left')
+            end = np.searchsorted(keys, probe, 'right')
+            if dx == 0 and dy == 0:
+                start = here + 1
+            counts = np.maximum(end - start, 0)
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            i = np.repeat(here, counts)
+            j = np.repeat(start, counts) + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            ox = sx[i] - sx[j]
+            oy = sy[i] - sy[j]
+            close = ox * ox + oy * oy < radius * radius
+            found_i.append(i[close])
+            found_j.append(j[close])
+        if not found_i:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty.astype(np.int64), empty, empty, empty
+        i = np.concatenate(found_i)
+        j = np.concatenate(found_j)
+        ox = sx[i] - sx[j]
+        oy = sy[i] - sy[j]
+        return order[i], order[j], ox, oy, np.hypot(ox, oy)
+
+    def _column_index(self, xy):
+        """
+        Sorts of the living units shared by every team's nearest-enemy query:
+        by (column, y) for the exact scan and by coarse representative cell
+        for the distance bound. Column width follows unit density, so a large
+        map is not scanned through thousands of near-empty columns.
+        """
+        cell_size = max(20.0, 3 * math.sqrt(self.width * self.height / max(1, len(xy))))
+        span = 4.0 * (self.width + self.height)
+        keys = np.floor(xy[:, 0] / cell_size) * span + xy[:, 1] + span / 2
+        by_column = np.argsort(keys, kind='stable')
+        # Keep the representative grid coarse enough that the bound stays a small dense product.
+        rep_size = max(cell_size, math.sqrt(self.width * self.height / 256))
+        rep_cells = np.floor(xy[:, 0] / rep_size) * (self.height // rep_size + 2) + np.floor(xy[:, 1] / rep_size)
+        by_rep = np.argsort(rep_cells, kind='stable')
+        return cell_size, span, keys[by_column], by_column, rep_cells[by_rep], by_rep
+
+    def _nearest_in(self, xy, queries, enemy, index, chunk=4096):
+        """
+        Exact nearest row of xy flagged in the enemy mask for each of
+        queries; returns indices into xy, lowest index on ties. index comes
+        from _column_index over the same xy.
+
+        A bound comes first from one representative enemy per grid cell; the
+        true nearest lies within that bound, so only enemies inside the
+        bounding disk, read column by column from the (column, y) sort, are
+        compared exactly.
+        """
+        cell_size, span, keys, by_column, rep_cells, by_rep = index
+        keep = enemy[by_column]
+        keys = keys[keep]
+        by_column = by_column[keep]
+        keep = enemy[by_rep]
+        rep_cells = rep_cells[keep]
+        lead = np.ones(rep_cells.size, dtype=bool)
+        lead[1:] = rep_cells[1:] != rep_cells[:-1]
+        reps = by_rep[keep][lead]
+        rx = xy[reps, 0]
+        ry = xy[reps, 1]
+
+        result = np.empty(queries.size, dtype=np.int64)
+        for s in range(0, queries.size, chunk):
+            q = queries[s:s + chunk]
+            qx = xy[q, 0]
+            qy = xy[q, 1]
+            dx = rx[None, :] - qx[:, None]
+            dy = ry[None, :] - qy[:, None]
+            bound = np.sqrt((dx * dx + dy * dy).min(axis=1)) * (1 + 1e-9) + 1e-9
+            self.checks += dx.size
+
+            first = np.floor((qx - bound) / cell_size).astype(np.int64)
+            n_cols = np.floor((qx + bound) / cell_size).astype(np.int64) - first + 1
+            qi = np.repeat(np.arange(q.size), n_cols)
+            col = first[qi] + np.arange(qi.size) - np.repeat(np.cumsum(n_cols) - n_cols, n_cols)
+            gap = np.maximum(0.0, np.maximum(col * cell_size - qx[qi], qx[qi] - (col + 1) * cell_size))
+            half = np.sqrt(np.maximum(bound[qi] ** 2 - gap * gap, 0.0))
+            base = col * span + span / 2 + qy[qi]
+            lo = np.searchsorted(keys, base - half, 'left')
+            counts = np.searchsorted(keys, base + half, 'right') - lo
+            pi = np.repeat(qi, counts)
+            pj = by_column[np.repeat(lo, counts) + np.arange(pi.size) - np.repeat(np.cumsum(counts) - counts, counts)]
+
+            dx = xy[pj, 0] - qx[pi]
+            dy = xy[pj, 1] - qy[pi]
+            d2 = dx * dx + dy * dy
+            self.checks += d2.size
+            # Pairs come grouped by query and every group holds at least the bounding enemy.
+            per_query = np.bincount(qi, weights=counts, minlength=q.size).astype(np.int64)
+            starts = np.cumsum(per_query) - per_query
+            nearest = np.minimum.reduceat(d2, starts)
+            ties = np.where(d2 == nearest[pi], pj, np.iinfo(np.int64).max)
+            result[s:s + chunk] = np.minimum.reduceat(ties, starts)
+        return result
+
+    def nearest_enemy(self):
+        """
+        Unit index of the nearest living enemy for every living unit, in
+        np.flatnonzero(self.alive) order, with -1 where there is none. Ties go
+        to the lower index, like the linear scan.
+        """
+        self.checks = 0
+        idx = np.flatnonzero(self.alive)
+        best = np.full(idx.size, -1, dtype=np.int64)
+        xy = self.xy[idx]
+        team = self.team[idx]
+        teams = np.unique(team)
+        if teams.size < 2:
+            return best
+        index = self._column_index(xy)
+        for t in teams:
+            own = team == t
+            best[own] = idx[self._nearest_in(xy, np.flatnonzero(own), ~own, index)]
+        return best
+
+    def _query_index(self):
+        if self.query_index is None:
+            idx = np.flatnonzero(self.alive)
+            xy = self.xy[idx]
+            cell_size, span, keys, by_column, _, _ = self._column_index(xy)
+            self.query_index = (idx[by_column], xy[by_column], cell_size, span, keys)
+        return self.query_index
+
+    def _in_box(self, x0, y0, x1, y1):
+        """(unit indices, positions) of the indexed units in the box, read column by column."""
+        units, xy, cell_size, span, keys = self._query_index()
+        cols = np.arange(math.floor(x0 / cell_size), math.floor(x1 / cell_size) + 1) * span + span / 2
+        lo = np.searchsorted(keys, cols + y0, 'left')
+        counts = np.searchsorted(keys, cols + y1, 'right') - lo
+        rows = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return units[rows], xy[rows]
+
+    def within(self, x, y, radius):
+        """
+        Indices of the units alive at the last step that lie within radius
+        of (x, y), ascending. Like along(), only the index columns the query
+        overlaps are read, so a query costs O(log n) plus what it finds.
+        """
+        units, xy = self._in_box(x - radius, y - radius, x + radius, y + radius)
+        dx = xy[:, 0] - x
+        dy = xy[:, 1] - y
+        return np.sort(units[dx * dx + dy * dy <= radius * radius]).tolist()
+
+    def along(self, x0, y0, x1, y1, width):
+        """Indices of the units alive at the last step within width of the segment, ascending."""
+        units, xy = self._in_box(min(x0, x1) - width, min(y0, y1) - width, max(x0, x1) + width, max(y0, y1) + width)
+        sx = x1 - x0
+        sy = y1 - y0
+        length2 = sx * sx + sy * sy
+        px = xy[:, 0] - x0
+        py = xy[:, 1] - y0
+        t = np.clip((px * sx + py * sy) / length2, 0.0, 1.0) if length2 else np.zeros(units.size)
+        dx = px - t * sx
+        dy = py - t * sy
+        return np.sort(units[dx * dx + dy * dy <= width * width]).tolist()
+
+    def _clamp(self, xy):
+        np.clip(xy[:, 0], self.margin, self.width - self.margin, out=xy[:, 0])
+        np.clip(xy[:, 1], self.margin, self.height - self.margin, out=xy[:, 1])
+        return xy
+
+    def step(self):
+        self.query_index = None
+        idx = np.flatnonzero(self.alive)
+        if idx.size == 0:
+            return
+        if self.sequential:
+            self._step_sequential(idx)
+            return
+        old = self.xy[idx]
+        target = self.nearest_enemy()
+        has_target = target >= 0
+        to_target = np.zeros((idx.size, 2))
+        to_target[has_target] = self.xy[target[has_target]] - old[has_target]
+        dist = np.hypot(to_target[:, 0], to_target[:, 1])
+        moving = dist > 0
+        if not moving.any():
+            return
+
+        heading = np.zeros((idx.size, 2))
+        heading[moving] = to_target[moving] / dist[moving, None]
+
+        n = idx.size
+        repulse = np.zeros((n, 2))
+        if self.min_sep > 0:
+            i, j, ox, oy, o_dist = self._close_pairs(old, self.min_sep)
+            apart = o_dist > 0
+            i = i[apart]
+            j = j[apart]
+            weight = (self.min_sep - o_dist[apart]) / self.min_sep / o_dist[apart]
+            fx = ox[apart] * weight
+            fy = oy[apart] * weight
+            repulse[:, 0] = np.bincount(i, fx, n) - np.bincount(j, fx, n)
+            repulse[:, 1] = np.bincount(i, fy, n) - np.bincount(j, fy, n)
+
+        noise = self.rng.uniform(-self.jitter, self.jitter, size=(n, 2))
+        new = old + heading * self.speed + repulse * self.sep_force + noise
+        new = self._clamp(np.where(moving[:, None], new, old))
+
+        if self.hard_min > 0:
+            i, j, ox, oy, o_dist = self._close_pairs(new, self.hard_min)
+            stacked = np.flatnonzero(o_dist == 0)
+            if stacked.size:
+                # Coincident units get a random shove, equal and opposite for the two of them.
+                ox[stacked] = self.rng.uniform(-1.0, 1.0, stacked.size)
+                oy[stacked] = self.rng.uniform(-1.0, 1.0, stacked.size)
+                o_dist[stacked] = np.hypot(ox[stacked], oy[stacked])
+            push = np.where(o_dist < self.hard_min, (self.hard_min - o_dist) / o_dist, 0.0)
+            fx = ox * push
+            fy = oy * push
+            # Like step_positions, only units that moved this tick get pushed.
+            new[:, 0] += (np.bincount(i, fx, n) - np.bincount(j, fx, n)) * moving
+            new[:, 1] += (np.bincount(i, fy, n) - np.bincount(j, fy, n)) * moving
+            new = self._clamp(new)
+
+        self.xy[idx] = new
+
+    def _step_sequential(self, idx):
+        xs = self.xy[:, 0].tolist()
+        ys = self.xy[:, 1].tolist()
+        move_units(
+            idx.tolist(), self.team.tolist(), xs, ys, self.width, self.height, self.speed, self.jitter,
+            self.margin, self.min_sep, self.sep_force, self.hard_min
+        )
+        self.xy[:, 0] = xs
+        self.xy[:, 1] = ys
+
+
+# ---------------------------------------------------------
+# 3. BATTLE
+# ---------------------------------------------------------
+
+# One resolved tick. event_type is "attack", "dgun" or "die" when a shot
+# landed; winner is the winning team index (-1 for a draw) once finished;
+# log is the LogEntry the tick added to the battle log, if any.
+TickEvent = namedtuple(
+    "TickEvent",
+    ["tick", "attacker", "victim", "event_type", "weapon", "damage", "log", "finished", "winner"]
+)
+
+
+def format_attack_log(tick, att_id, att_hex, vic_id, vic_hex, weapon, dmg, killed):
+    action = "comblast hits" if weapon == "Comblast" else f"fires {weapon}"
+    log_entry = (
+        f"[{tick}] <span style='color:{att_hex}'>COM_{att_id}</span> "
+        f"{action} >> <span style='color:{vic_hex}'>COM_{vic_id}</span> "
+        f"(-{dmg} HP)"
+    )
+    if weapon == "D-GUN":
+        log_entry = f"<span class='log-dgun'>{log_entry}</span>"
+    elif weapon == "Comblast":
+        log_entry = f"<span class='log-blast'>{log_entry}</span>"
+    if killed:
+        log_entry += " <span class='log-kill'>[COMBLAST]</span>"
+    return log_entry
+
+
+def format_game_over_log(winner):
+    msg = f"GAME OVER. TEAM {winner + 1} VICTORY." if winner != -1 else "DRAW. MUTUAL ANNIHILATION."
+    return f"<span style='color:#00ff00'> >> {msg}</span>"
+
+
+# One battle log line. attacker and victim are dense unit indices (for a
+# comblast, the attacker is the commander that exploded); the game-over line
+# has no attacker and holds the winning team (-1 for a draw) in victim.
+LogEntry = namedtuple("LogEntry", ["tick", "attacker", "victim", "weapon", "damage", "killed"])
+
+LOG_WEAPONS = (None, "Laser", "D-GUN", "Comblast")
+LOG_RECORD = struct.Struct("<IiiBHB")
+
+
+def format_log_entry(entry, ids, hex_of):
+    if entry.attacker is None:
+        return format_game_over_log(entry.victim)
+    att, vic = entry.attacker, entry.victim
+    return format_attack_log(
+        entry.tick, ids[att], hex_of[att], ids[vic], hex_of[vic], entry.weapon, entry.damage, entry.killed
+    )
+
+
+class BattleLog:
+    """
+    The last `limit` LogEntry tuples in a ring buffer. HTML is built only by
+    html(), only for entries added since the previous call, so an unchanged
+    log costs nothing to redraw.
+
+    With spill_path, every entry is also appended to a binary file, keeping
+    the full history on disk while memory stays at `limit` entries;
+    history() reads it back.
+    """
+
+    def __init__(self, ids, hex_of, limit=LOG_LIMIT, spill_path=None):
+        self.ids = ids
+        self.hex_of = hex_of
+        self.entries = deque(maxlen=limit)
+        self.lines = deque(maxlen=limit)
+        self.pending = 0
+        self.html_text = ""
+        self.spill_path = spill_path
+        self.spill = open(spill_path, "wb") if spill_path else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def append(self, entry):
+        self.entries.append(entry)
+        self.pending += 1
+        if self.spill is not None:
+            attacker = -1 if entry.attacker is None else entry.attacker
+            self.spill.write(LOG_RECORD.pack(
+                entry.tick, attacker, entry.victim, LOG_WEAPONS.index(entry.weapon), entry.damage, entry.killed
+            ))
+
+    def html(self):
+        """Newest-first lines joined with <br>, as the battle-log box shows them."""
+        if self.pending:
+            fresh = min(self.pending, len(self.entries))
+            for k in range(len(self.entries) - fresh, len(self.entries)):
+                self.lines.append(format_log_entry(self.entries[k], self.ids, self.hex_of))
+            self.pending = 0
+            self.html_text = "<br>".join(reversed(self.lines))
+        return self.html_text
+
+    def history(self):
+        """Every entry ever logged, oldest first; needs spill_path."""
+        if self.spill_path is None:
+            raise RuntimeError("history needs a BattleLog created with spill_path")
+        if self.spill is not None:
+            self.spill.flush()
+        return self._read_spill()
+
+    def _read_spill(self):
+        with open(self.spill_path, "rb") as handle:
+            while True:
+                chunk = handle.read(LOG_RECORD.size * 4096)
+                if not chunk:
+                    break
+                for tick, att, vic, weapon, dmg, killed in LOG_RECORD.iter_unpack(chunk):
+                    yield LogEntry(tick, None if att < 0 else att, vic, LOG_WEAPONS[weapon], dmg, bool(killed))
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+class BattleState:
+    """
+    Structure-of-arrays battle state. Unit i is players[i]: every per-unit
+    column is an array indexed by that dense id, and alive lists the living
+    ids in ascending order, kept up to date as units die instead of being
+    rebuilt every tick.
+    """
+
+    def __init__(self, players, teams, positions):
+        n = len(players)
+        team_of = {p['id']: t_idx for t_idx, tm in enumerate(teams) for p in tm}
+        self.ids = [p['id'] for p in players]
+        self.index = {pid: i for i, pid in enumerate(self.ids)}
+        self.faction_names = list(dict.fromkeys(p['faction'] for p in players))
+        faction_code = {f: code for code, f in enumerate(self.faction_names)}
+
+        self.hp = array('i', [100]) * n
+        self.energy = array('i', [50]) * n
+        self.x = array('d', (positions[pid]['x'] for pid in self.ids))
+        self.y = array('d', (positions[pid]['y'] for pid in self.ids))
+        self.team = array('i', (team_of[pid] for pid in self.ids))
+        self.faction = array('b', (faction_code[p['faction']] for p in players))
+        self.spawn_tick = array('i', [0]) * n
+        # NO_TICK marks a unit that has not died.
+        self.death_tick = array('i', [NO_TICK]) * n
+
+        self.alive = list(range(n))
+        self.team_alive = [0] * len(teams)
+        for t_idx in self.team:
+            self.team_alive[t_idx] += 1
+
+    def kill(self, i, tick):
+        self.hp[i] = 0
+        self.death_tick[i] = tick
+        del self.alive[bisect_left(self.alive, i)]
+        self.team_alive[self.team[i]] -= 1
+
+    def teams_left(self):
+        return [t_idx for t_idx, count in enumerate(self.team_alive) if count]
+
+    def recount_alive(self):
+        """
+        Rebuilds alive and team_alive from hp after the columns were written
+        directly, e.g. when restoring a replay keyframe.
+        """
+        self.alive = [i for i, hp in enumerate(self.hp) if hp > 0]
+        self.team_alive = [0] * len(self.team_alive)
+        for i in self.alive:
+            self.team_alive[self.team[i]] += 1
+
+
+class BattleSimulator:
+    """
+    Runs a battle between the given teams one tick at a time, with no UI and
+    no sleeping. players is the full commander list and teams the output of
+    chunk_list; state and log (a BattleLog) are public so a UI can draw them
+    after every step(). Events name units by commander id; state indexes them
+    densely in players order. ctx supplies the spawn, movement and combat
+    streams; the same ctx seed always fights the same battle.
+
+    movement picks one of MOVEMENT_MODES. "array" trades the exact
+    one-after-another movement of the default for a batched NumPy step, and
+    is what keeps ticks in the tens of milliseconds at 10,000 units.
+    log_spill is an optional file path that keeps the log's full history.
+
+    combat picks one of COMBAT_MODES. In "simultaneous" fire all shots of a
+    tick are resolved together: damage is summed per victim, and units that
+    die still get their own shot off. shots holds the LogEntry of every shot
+    fired in the last tick; events describe the first of them.
+
+    area_effects turns on comblasts and D-GUN lines of fire (see
+    COMBLAST_RADIUS). Their hits follow the shots in shots and the log, and
+    are found with radius and segment queries on the spatial index (grid,
+    or the engine in "array" movement) instead of scans over every unit.
+    """
+
+    def __init__(
+        self,
+        players,
+        teams,
+        width=MAP_WIDTH,
+        height=MAP_HEIGHT,
+        log_limit=LOG_LIMIT,
+        ctx=None,
+        movement="grid",
+        log_spill=None,
+        combat="single",
+        area_effects=False
+    ):
+        if movement not in MOVEMENT_MODES:
+            raise ValueError(f"unknown movement mode: {movement}")
+        if combat not in COMBAT_MODES:
+            raise ValueError(f"unknown combat mode: {combat}")
+        self.ctx = ctx or SimContext()
+        self.players = players
+        self.teams = teams
+        self.width = width
+        self.height = height
+        self.log_limit = log_limit
+        self.hex_of = [p['hex'] for p in players]
+        self.state = BattleState(players, teams, initialize_positions(teams, width, height, rng=self.ctx.spawn))
+        self.grid = SpatialGrid(enemy_grid_cell_size(len(players), width, height))
+        self.engine = None
+        if movement == "array":
+            state = self.state
+            self.engine = ArrayMovementEngine(
+                state.ids, state.team, np.column_stack([state.x, state.y]), width, height, seed=self.ctx.movement.np
+            )
+        self.combat = combat
+        self.area_effects = area_effects
+        self.shots = []
+        self.tick = 0
+        self.log = BattleLog(self.state.ids, self.hex_of, log_limit, log_spill)
+        self.finished = False
+        self.winner = None
+        # Optional sink with a record(event) method, called after every step.
+        self.recorder = None
+        # Optional TickProfiler; when set, every step is timed by phase.
+        self.profiler = None
+
+    def step(self):
+        prof = self.profiler
+        if prof is not None:
+            prof.begin(self.tick + 1)
+        event = self._advance()
+        if prof is not None:
+            prof.lap("combat")
+            prof.count("distance_checks", self.grid.checks)
+        if self.recorder is not None:
+            self.recorder.record(event)
+            if prof is not None:
+                prof.lap("replay")
+        return event
+
+    def _advance(self):
+        if self.finished:
+            raise RuntimeError("battle is already finished")
+
+        self.tick += 1
+        tick = self.tick
+        state = self.state
+        alive = state.alive
+        self.shots = []
+
+        teams_left = state.teams_left()
+        if len(teams_left) <= 1:
+            self.finished = True
+            self.winner = teams_left[0] if teams_left else -1
+            entry = LogEntry(tick, None, self.winner, None, 0, False)
+            self.log.append(entry)
+            self.log.close()
+            return TickEvent(tick, None, None, None, None, 0, entry, True, self.winner)
+
+        if self.engine is None:
+            move_units(alive, state.team, state.x, state.y, self.width, self.height, grid=self.grid, rng=self.ctx.movement)
+        else:
+            self._move_batched()
+        if self.profiler is not None:
+            self.profiler.lap("movement")
+        energy = state.energy
+        for i in alive:
+            energy[i] = min(100, energy[i] + 5)
+        if self.combat == "simultaneous":
+            return self._volley(tick)
+
+        combat = self.ctx.combat
+        att = combat.choice(alive)
+        att_id = state.ids[att]
+        vic = self.grid.nearest_enemy(att) if self.engine is None else self._nearest_enemy_of(att)
+        if self.profiler is not None:
+            self.profiler.lap("targeting")
+        if vic is None:
+            return TickEvent(tick, att_id, None, None, None, 0, None, False, None)
+
+        dx = state.x[vic] - state.x[att]
+        dy = state.y[vic] - state.y[att]
+        if math.hypot(dx, dy) > FIRE_RANGE:
+            return TickEvent(tick, att_id, None, None, None, 0, None, False, None)
+
+        current_en = energy[att]
+        if current_en >= 100 and combat.random() < DGUN_CHANCE:
+            dmg = DGUN_DAMAGE
+            energy[att] = 0
+            event_type = "dgun"
+            wpn_name = "D-GUN"
+        else:
+            dmg = combat.randint(*LASER_DAMAGE)
+            energy[att] = max(0, current_en - 10)
+            event_type = "attack"
+            wpn_name = "Laser"
+
+        state.hp[vic] -= dmg
+        vic_id = state.ids[vic]
+        killed = state.hp[vic] <= 0
+        if killed:
+            self._kill(vic, tick)
+            event_type = "die"
+
+        entry = LogEntry(tick, att, vic, wpn_name, dmg, killed)
+        self.log.append(entry)
+        self.shots = [entry]
+        if self.area_effects:
+            self.shots += self._area_hits(tick, self.shots)
+        return TickEvent(tick, att_id, vic_id, event_type, wpn_name, dmg, entry, False, None)
+
+    def _volley(self, tick):
+        """
+        Simultaneous fire: every living unit within FIRE_RANGE of its nearest
+        enemy shoots, and the tick's damage lands on all victims at once.
+        """
+        state = self.state
+        alive = np.array(state.alive, dtype=np.int64)
+        if self.engine is None:
+            target = np.array([self.grid.nearest_enemy(i) for i in state.alive], dtype=np.int64)
+        else:
+            target = self.engine.nearest_enemy()
+            self.grid.checks = self.engine.checks
+        if self.profiler is not None:
+            self.profiler.lap("targeting")
+
+        xs = np.frombuffer(state.x, dtype=np.float64)
+        ys = np.frombuffer(state.y, dtype=np.float64)
+        in_range = np.hypot(xs[target] - xs[alive], ys[target] - ys[alive]) <= FIRE_RANGE
+        att = alive[in_range]
+        vic = target[in_range]
+        if att.size == 0:
+            return TickEvent(tick, None, None, None, None, 0, None, False, None)
+
+        rng = self.ctx.combat.np
+        energy = np.frombuffer(state.energy, dtype=np.int32)
+        hp = np.frombuffer(state.hp, dtype=np.int32)
+        dgun = (energy[att] >= 100) & (rng.random(att.size) < DGUN_CHANCE)
+        dmg = np.where(dgun, DGUN_DAMAGE, rng.integers(LASER_DAMAGE[0], LASER_DAMAGE[1] + 1, att.size))
+        energy[att] = np.where(dgun, 0, np.maximum(0, energy[att] - 10))
+        hp -= np.bincount(vic, weights=dmg, minlength=hp.size).astype(np.int32)
+
+        # A kill is credited to the last shot at the victim, so replaying the
+        # shots in order ends on the comblast.
+        last_shot = np.zeros(att.size, dtype=bool)
+        _, from_end = np.unique(vic[::-1], return_index=True)
+        last_shot[att.size - 1 - from_end] = True
+        killed = last_shot & (hp[vic] <= 0)
+        for i in np.unique(vic[killed]).tolist():
+            self._kill(i, tick)
+
+        weapons = np.where(dgun, "D-GUN", "Laser").tolist()
+        self.shots = [
+            LogEntry(tick, a, v, w, d, k)
+            for a, v, w, d, k in zip(att.tolist(), vic.tolist(), weapons, dmg.tolist(), killed.tolist())
+        ]
+        for entry in self.shots:
+            self.log.append(entry)
+        if self.area_effects:
+            self.shots += self._area_hits(tick, self.shots)
+
+        first = self.shots[0]
+        if first.killed:
+            event_type = "die"
+        else:
+            event_type = "dgun" if first.weapon == "D-GUN" else "attack"
+        return TickEvent(
+            tick, state.ids[first.attacker], state.ids[first.victim], event_type,
+            first.weapon, first.damage, first, False, None,
+        )
+
+    def _area_hits(self, tick, shots):
+        """
+        Lands the D-GUN line hits and the comblast chain set off by this
+        tick's shots; returns their LogEntry tuples in the order they landed.
+        """
+        state = self.state
+        index = self.grid if self.engine is None else self.engine
+        hits = []
+        for shot in shots:
+            if shot.weapon != "D-GUN":
+                continue
+            x0, y0 = state.x[shot.attacker], state.y[shot.attacker]
+            dx = state.x[shot.victim] - x0
+            dy = state.y[shot.victim] - y0
+            dist = math.hypot(dx, dy)
+            if dist == 0:
+                continue
+            # The shot carries on past its target to the end of its range.
+            x1 = x0 + dx / dist * FIRE_RANGE
+            y1 = y0 + dy / dist * FIRE_RANGE
+            for j in index.along(x0, y0, x1, y1, DGUN_WIDTH):
+                if j != shot.attacker and state.hp[j] > 0:
+                    hits.append(self._hit(tick, shot.attacker, j, "D-GUN", DGUN_DAMAGE))
+
+        blasts = deque(entry.victim for entry in shots + hits if entry.killed)
+        while blasts:
+            b = blasts.popleft()
+            bx, by = state.x[b], state.y[b]
+            for j in index.within(bx, by, COMBLAST_RADIUS):
+                if state.hp[j] <= 0:
+                    continue
+                dmg = math.ceil(COMBLAST_DAMAGE * (1 - math.hypot(state.x[j] - bx, state.y[j] - by) / COMBLAST_RADIUS))
+                if dmg <= 0:
+                    continue
+                entry = self._hit(tick, b, j, "Comblast", dmg)
+                hits.append(entry)
+                if entry.killed:
+                    blasts.append(j)
+        return hits
+
+    def _hit(self, tick, att, vic, weapon, dmg):
+        state = self.state
+        state.hp[vic] -= dmg
+        killed = state.hp[vic] <= 0
+        if killed:
+            self._kill(vic, tick)
+        entry = LogEntry(tick, att, vic, weapon, dmg, killed)
+        self.log.append(entry)
+        return entry
+
+    def _kill(self, i, tick):
+        self.state.kill(i, tick)
+        if self.engine is not None:
+            self.engine.alive[i] = False
+
+    def _move_batched(self):
+        engine = self.engine
+        engine.step()
+        # The engine only moves living units, so dead ones keep their last spot here too.
+        np.frombuffer(self.state.x, dtype=np.float64)[:] = engine.xy[:, 0]
+        np.frombuffer(self.state.y, dtype=np.float64)[:] = engine.xy[:, 1]
+
+    def _nearest_enemy_of(self, i):
+        """Nearest living enemy of unit i by one vectorized scan, lowest index on ties."""
+        engine = self.engine
+        enemies = np.flatnonzero(engine.alive & (engine.team != engine.team[i]))
+        if enemies.size == 0:
+            return None
+        offset = engine.xy[enemies] - engine.xy[i]
+        self.grid.checks = enemies.size
+        return int(enemies[np.argmin(np.einsum('ij,ij->i', offset, offset))])
+
+    def run_to_completion(self, max_ticks=None):
+        events = []
+        while not self.finished and (max_ticks is None or self.tick < max_ticks):
+            events.append(self.step())
+        return events
+
+
+# ---------------------------------------------------------
+# 4. PACING
+# ---------------------------------------------------------
+
+def run_realtime(
+    sim, tick_seconds, render, max_fps=20, max_catch_up=10, clock=time.perf_counter, sleep=time.sleep, stop=None
+):
+    """
+    Drives sim on a fixed timestep of tick_seconds and calls render(event)
+    with the latest event at most max_fps times a second.
+
+    Sleeps are computed from the wall clock, so render time comes out of the
+    tick budget instead of adding to it. When rendering falls behind, several
+    ticks run per frame and the ones in between are never drawn; a backlog
+    longer than max_catch_up ticks is dropped rather than chased. The final
+    tick is always rendered, unless stop() returns true first, which ends
+    the run between ticks with the battle unfinished.
+    """
+    frame_seconds = 1.0 / max_fps if max_fps else 0.0
+    next_tick = clock()
+    next_frame = next_tick
+    event = None
+    while not sim.finished and not (stop is not None and stop()):
+        now = clock()
+        ran = 0
+        while now >= next_tick and not sim.finished and ran < max_catch_up:
+            event = sim.step()
+            next_tick += tick_seconds
+            ran += 1
+        if ran == max_catch_up and now >= next_tick:
+            next_tick = now
+
+        if ran and (sim.finished or now >= next_frame):
+            render(event)
+            next_frame = max(next_frame + frame_seconds, clock())
+
+        if not sim.finished:
+            sleep(max(0.0, next_tick - clock()))
+    return event
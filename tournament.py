@@ -0,0 +1,238 @@
+"""
+Monte Carlo tournament runner for judging team-split balance.
+
+Runs many headless battles across a process pool, one seed per battle, and
+streams a row per battle to CSV or Parquet as workers finish:
+
+    python tournament.py --battles 5000 --commanders 32 --teams 2 --out runs.csv
+
+A summary of win rates, battle length, D-GUN kill share and faction survival
+is printed at the end.
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import statistics
+
+from lobby import FACTIONS, SPLIT_METHODS, initialize_commanders, partition_teams
+from rng import SimContext
+from simulation import COMBAT_MODES, BattleSimulator
+
+# ---------------------------------------------------------
+# 1. SINGLE BATTLE
+# ---------------------------------------------------------
+
+def battle_columns():
+    columns = ["seed", "commanders", "teams", "winner", "ticks", "kills", "dgun_kills", "comblast_kills", "survivors"]
+    for f in FACTIONS:
+        columns += [f"{f.lower()}_count", f"{f.lower()}_survivors"]
+    return columns
+
+
+def run_battle(job):
+    """
+    Rolls a lobby, splits it the way the app does and fights it out. job is
+    (seed, commanders, teams, max_ticks, split, combat, area_effects);
+    returns one result row as a dict.
+    """
+    seed, commanders, num_teams, max_ticks, split, combat, area_effects = job
+    ctx = SimContext(seed)
+
+    players = initialize_commanders(commanders, rng=ctx.lobby)
+    teams = partition_teams(players, num_teams, split)
+    sim = BattleSimulator(players, teams, ctx=ctx, combat=combat, area_effects=area_effects)
+
+    kills = 0
+    dgun_kills = 0
+    comblast_kills = 0
+    while not sim.finished and (max_ticks is None or sim.tick < max_ticks):
+        sim.step()
+        # Simultaneous fire and area effects can land several kills in one tick.
+        for shot in sim.shots:
+            if shot.killed:
+                kills += 1
+                if shot.weapon == "D-GUN":
+                    dgun_kills += 1
+                elif shot.weapon == "Comblast":
+                    comblast_kills += 1
+
+    row = {
+        "seed": seed,
+        "commanders": commanders,
+        "teams": num_teams,
+        "winner": sim.winner if sim.finished else None,
+        "ticks": sim.tick,
+        "kills": kills,
+        "dgun_kills": dgun_kills,
+        "comblast_kills": comblast_kills,
+        "survivors": len(sim.state.alive),
+    }
+    state = sim.state
+    for f in FACTIONS:
+        members = [i for i, p in enumerate(players) if p['faction'] == f]
+        row[f"{f.lower()}_count"] = len(members)
+        row[f"{f.lower()}_survivors"] = sum(1 for i in members if state.hp[i] > 0)
+    return row
+
+# ---------------------------------------------------------
+# 2. OUTPUT
+# ---------------------------------------------------------
+
+class CsvSink:
+    def __init__(self, path, columns):
+        self.handle = open(path, "w", newline="")
+        self.writer = csv.DictWriter(self.handle, fieldnames=columns)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+class ParquetSink:
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(c, pa.int64()) for c in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        data = {c: [r[c] for r in rows] for c in self.columns}
+        self.writer.write_table(self.pa.table(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_sink(path, columns):
+    if path is None:
+        return None
+    if path.endswith(".parquet"):
+        return ParquetSink(path, columns)
+    return CsvSink(path, columns)
+
+# ---------------------------------------------------------
+# 3. TOURNAMENT
+# ---------------------------------------------------------
+
+def summarize(rows, num_teams):
+    finished = [r for r in rows if r["winner"] is not None]
+    wins = [0] * num_teams
+    draws = 0
+    for r in finished:
+        if r["winner"] == -1:
+            draws += 1
+        else:
+            wins[r["winner"]] += 1
+
+    ticks = sorted(r["ticks"] for r in rows)
+    kills = sum(r["kills"] for r in rows)
+    summary = {
+        "battles": len(rows),
+        "unfinished": len(rows) - len(finished),
+        "win_rate": [w / max(1, len(finished)) for w in wins],
+        "draw_rate": draws / max(1, len(finished)),
+        "ticks_mean": statistics.fmean(ticks) if ticks else 0.0,
+        "ticks_median": statistics.median(ticks) if ticks else 0,
+        "ticks_p95": ticks[int(0.95 * (len(ticks) - 1))] if ticks else 0,
+        "dgun_kill_share": sum(r["dgun_kills"] for r in rows) / max(1, kills),
+        "comblast_kill_share": sum(r["comblast_kills"] for r in rows) / max(1, kills),
+        "faction_survival": {},
+    }
+    for f in FACTIONS:
+        count = sum(r[f"{f.lower()}_count"] for r in rows)
+        alive = sum(r[f"{f.lower()}_survivors"] for r in rows)
+        summary["faction_survival"][f] = alive / max(1, count)
+    return summary
+
+
+def run_tournament(
+    battles,
+    commanders,
+    num_teams,
+    workers=None,
+    seed=0,
+    max_ticks=None,
+    out=None,
+    flush_every=100,
+    split="cohesive",
+    combat="single",
+    area_effects=False
+):
+    """
+    Runs the given number of headless battles on a process pool and returns
+    the summary. Battle i uses seed + i, so any single battle can be
+    replayed on its own with run_battle.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = [(seed + i, commanders, num_teams, max_ticks, split, combat, area_effects) for i in range(battles)]
+    # Several battles per task keeps pickling overhead low without starving workers at the tail.
+    chunksize = max(1, battles // (workers * 8))
+
+    columns = battle_columns()
+    sink = open_sink(out, columns)
+    rows = []
+    pending = []
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for row in pool.imap_unordered(run_battle, jobs, chunksize):
+                rows.append(row)
+                pending.append(row)
+                if sink is not None and len(pending) >= flush_every:
+                    sink.write(pending)
+                    pending = []
+        if sink is not None and pending:
+            sink.write(pending)
+    finally:
+        if sink is not None:
+            sink.close()
+    return summarize(rows, num_teams)
+
+
+def print_summary(summary):
+    print(f"Battles: {summary['battles']} ({summary['unfinished']} hit the tick limit)")
+    for t_idx, rate in enumerate(summary["win_rate"]):
+        print(f"  Team {t_idx + 1} win rate: {rate:.1%}")
+    print(f"  Draw rate: {summary['draw_rate']:.1%}")
+    print(
+        f"Battle length (ticks): mean {summary['ticks_mean']:.1f}, "
+        f"median {summary['ticks_median']}, p95 {summary['ticks_p95']}"
+    )
+    print(f"D-GUN kill share: {summary['dgun_kill_share']:.1%}")
+    print(f"Comblast kill share: {summary['comblast_kill_share']:.1%}")
+    for f, rate in summary["faction_survival"].items():
+        print(f"  {f} survival: {rate:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many headless BAR Commander battles.")
+    parser.add_argument("--battles", type=int, default=1000)
+    parser.add_argument("--commanders", type=int, default=32)
+    parser.add_argument("--teams", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the CPU count")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first battle")
+    parser.add_argument("--max-ticks", type=int, default=None)
+    parser.add_argument("--split", choices=SPLIT_METHODS, default="cohesive", help="team split method")
+    parser.add_argument("--combat", choices=COMBAT_MODES, default="single", help="who fires each tick")
+    parser.add_argument("--area-effects", action="store_true", help="comblasts and D-GUN lines hit every unit in reach")
+    parser.add_argument("--out", default=None, help="CSV path, or .parquet for Parquet")
+    args = parser.parse_args()
+
+    summary = run_tournament(
+        args.battles, args.commanders, args.teams,
+        workers=args.workers, seed=args.seed, max_ticks=args.max_ticks, out=args.out,
+        split=args.split, combat=args.combat, area_effects=args.area_effects
+    )
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()